@@ -66,8 +66,8 @@ def between(comparator, records1, records2, comparisons=None):
 
 
 class Index:
-    """An "Index" that compares all pairs of records.  The `makekey`
-    parameter is ignored.
+    """An "Index" that compares all pairs of records.  The `makekey` and
+    `keepkeys` parameters are ignored.
 
     >>> from dedupe import allpairs
     >>> comparator = lambda a, b: int(a == b)
@@ -77,7 +77,7 @@ class Index:
     {('B', 'C'): 0, ('A', 'B'): 0, ('A', 'A'): 1, ('A', 'C'): 0}
     """
 
-    def __init__(self, makekey=None, records=None):
+    def __init__(self, makekey=None, records=None, keepkeys=False):
         # pylint: disable=W0613
         self.records = records if records else []
 
@@ -93,6 +93,11 @@ class Index:
         """Add a record to the index"""
         self.records.append(record)
 
+    def getkeys(self, record):
+        """Records have no keys in this index, so return :keyword:`None`."""
+        # pylint: disable=W0613
+        return None
+
     def compare(self, simfunc, other=None, comparisons=None):
         """Compute similarity vectors for all pairs of records."""
         if other is None or other is self:
@@ -23,6 +23,10 @@ class Index(dict):
     :type records: [`R`, ...]
     :param records: Initial records to load into the index.
 
+    :type keepkeys: :class:`bool`
+    :param keepkeys: Keep the keys of each inserted record, so that\
+    :meth:`getkeys` looks them up instead of calling `makekey` again.
+
     >>> makekey = lambda r: [int(r[1])]
     >>> makekey(('A', 3.5))
     [3]
@@ -41,11 +45,17 @@ class Index(dict):
     >>> a.compare(compare, b)  #doctest: +NORMALIZE_WHITESPACE
     {(('C', 5.0), ('D', 5.5)): 0.7071067811865476,\
     (('A', 5.5), ('D', 5.5)): 1.0, (('B', 4.5), ('E', 4.5)): 1.0}
+    >>> c = block.Index(makekey, [('A', 5.5)], keepkeys=True)
+    >>> c.recordkeys
+    {('A', 5.5): [5]}
+    >>> c.getkeys(('A', 5.5)), c.getkeys(('B', 4.5))
+    ([5], [4])
     """
 
-    def __init__(self, makekey, records=None):
+    def __init__(self, makekey, records=None, keepkeys=False):
         super(Index, self).__init__()
         self.makekey = makekey
+        self.recordkeys = {} if keepkeys else None
         if records:
             for record in records:
                 self.insert(record)
@@ -65,8 +75,22 @@ class Index(dict):
                     repr(keys), repr(record)))
             recordsforkey = self.setdefault(key, list())
             recordsforkey.append(record)
+        if self.recordkeys is not None:
+            self.recordkeys[record] = keys
         return keys
 
+    def getkeys(self, record):
+        """Keys of a record, as kept on insertion if `keepkeys` was set.
+
+        :rtype: [`K`, ...]
+        """
+        if self.recordkeys is not None:
+            try:
+                return self.recordkeys[record]
+            except KeyError:
+                pass
+        return self.makekey(record)
+
     def count(self, other=None):
         """Return upper bound on the number of comparisons required by this
         index. The actual number of comparison function calls will be lower
@@ -141,7 +165,7 @@ class Index(dict):
         if comparisons is None:
             comparisons = {}
         for indexkey in self.iterkeys():
-            if indexkey in other.iterkeys():
+            if indexkey in other:
                 for rec1 in self[indexkey]:
                     for rec2 in other[indexkey]:
                         pair = (rec1, rec2)
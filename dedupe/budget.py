@@ -0,0 +1,253 @@
+"""Estimate the cost of a linkage before running it
+
+:meth:`~sim.Indices.log_comparisons` logs an upper bound on the comparisons
+of each index, but pairs that share keys in several indices are only
+compared once.  :func:`estimate` instead samples records, finds the distinct
+records that share a key with each in any index, and times the comparator on
+a sample of those pairs, predicting the number of distinct pairs, the memory
+for their similarity vectors and the time to compare them.
+
+A :class:`Budget` sets limits on these, and raises :exc:`BudgetExceeded` (or
+logs a warning) when an estimate is over them, so that a misconfigured
+blocking key is caught before it runs for hours.
+"""
+
+from collections import namedtuple
+import logging
+import random
+import sys
+import time
+
+import dedupe.sim as sim
+
+LOG = logging.getLogger('dedupe.budget')
+
+
+class Estimate(namedtuple('Estimate', 'pairs upper seconds memory sampled')):
+    """Predicted cost of a linkage: distinct pairs, sum of the per-index
+    upper bounds, seconds and bytes of memory to compare the pairs, and the
+    number of records sampled."""
+    __slots__ = ()
+
+
+class BudgetExceeded(Exception):
+    """Raised when the estimated cost of a linkage is over budget."""
+    pass
+
+
+# Most records in the blocks of a sampled record for finding its distinct
+# partners, above which the block sizes are summed instead
+_MAXUNION = 10000
+
+
+def _blocks(record, indices, other):
+    """Blocks of records sharing an index key with `record`, in the `other`
+    indices or else in the same `indices`, or :keyword:`None` for all the
+    records when an index has no keys."""
+    blocks = []
+    if other is None:
+        other = indices
+    for index, otherindex in zip(indices.itervalues(), other.itervalues()):
+        keys = sim.getkeys(index, record)
+        if keys is None:
+            return None
+        for key in keys:
+            found = otherindex.get(key)
+            if found:
+                blocks.append(found)
+    return blocks
+
+
+def _partners(record, blocks, selflink):
+    """Number of distinct records other than `record` in the `blocks`.  When
+    the blocks are large this is instead the sum of their sizes, less the
+    `record` itself in each block when it is linked to its own indices,
+    which counts a record in several blocks more than once."""
+    total = sum(len(found) for found in blocks)
+    if total > _MAXUNION:
+        return total - len(blocks) if selflink else total
+    partners = set()
+    for found in blocks:
+        partners.update(found)
+    if selflink:
+        partners.discard(record)
+    return len(partners)
+
+
+def _choose(rand, record, blocks):
+    """Random record other than `record` from the `blocks`, without copying
+    them, or :keyword:`None` if there is none."""
+    total = sum(len(found) for found in blocks)
+    if not total:
+        return None
+    for _ in xrange(5):
+        position = rand.randrange(total)
+        for found in blocks:
+            if position < len(found):
+                if found[position] is not record:
+                    return found[position]
+                break
+            position -= len(found)
+    return None
+
+
+def _vectorsize(pair, vector):
+    """Approximate bytes for a pair and its similarity vector in a dict."""
+    return (sys.getsizeof(pair) + sys.getsizeof(vector) +
+            sum(sys.getsizeof(value) for value in vector) +
+            # dictionary slot of hash, key and value, at two-thirds load
+            3 * 3 * sys.getsizeof(0) // 2)
+
+
+def sample_pairs(records, indices, other=None, otherrecords=None,
+                 sample=1000, seed=0):
+    """Estimate the distinct pairs compared by `indices` from the records
+    sharing a key with each of a sample of `records`.  Records whose blocks
+    hold more than :data:`_MAXUNION` records count the sum of the block
+    sizes, which may count a pair more than once.
+
+    :rtype: (:class:`float`, [(`R`, `R`), ...], :class:`int`)
+    :return: Estimated distinct pairs, a random pair for each sampled\
+    record that has any, and the number of records sampled.
+    """
+    if other is not None and other is not indices:
+        nright = len(otherrecords)
+    else:
+        other, nright = None, len(records)
+    if not records or not nright:
+        return 0.0, [], 0
+    rand = random.Random(seed)
+    chosen = sorted(rand.sample(xrange(len(records)),
+                                min(sample, len(records))))
+    partners, pairs = 0, []
+    for position in chosen:
+        record = records[position]
+        blocks = _blocks(record, indices, other)
+        if blocks is None:
+            count = nright - (other is None)
+            partner = (otherrecords if other else records)[
+                rand.randrange(nright)]
+        else:
+            count = _partners(record, blocks, other is None)
+            partner = _choose(rand, record, blocks)
+        partners += count
+        if partner is not None and partner is not record:
+            pairs.append((record, partner))
+    mean = float(partners) / len(chosen)
+    # each pair is found from both of its records when linking to itself
+    return mean * len(records) / (2 if other is None else 1), pairs, \
+        len(chosen)
+
+
+def estimate(records, indices, comparator, other=None, otherrecords=None,
+             sample=1000, seed=0):
+    """Estimate the distinct pairs compared by `indices`, and the time and
+    memory to compare them, from a sample of `records`.
+
+    :type records: [`R`, ...]
+    :param records: Records in the `indices`.
+    :type indices: :class:`~sim.Indices`
+    :param indices: Indices of the records.
+    :type comparator: function(`R`, `R`) [:class:`float`, ...]
+    :param comparator: Comparator that is timed on sample pairs.
+    :type other: :class:`~sim.Indices`
+    :param other: Indices of master records to link against.
+    :type otherrecords: [`R`, ...]
+    :param otherrecords: Master records in `other`.
+    :type sample: :class:`int`
+    :param sample: Number of records to sample.
+    :type seed: :class:`int`
+    :param seed: Seed for choosing the sample.
+    :rtype: :class:`Estimate`
+
+    With a sample of all the records the pair count is exact:
+
+    >>> from dedupe import block, budget, sim
+    >>> records = [('A', 5.5), ('B', 4.5), ('C', 5.25), ('D', 5.0)]
+    >>> strategy = [("Int", block.Index, lambda r: [int(r[1])]),
+    ...             ("Name", block.Index, lambda r: [r[0] < 'C'])]
+    >>> indices = sim.Indices(strategy, records)
+    >>> comparator = lambda a, b: (float(a[1] == b[1]),)
+    >>> result = budget.estimate(records, indices, comparator)
+    >>> result.pairs, result.upper, len(indices.compare(comparator))
+    (4.0, 5, 4)
+    >>> result.sampled, result.seconds < 1, result.memory > 0
+    (4, True, True)
+    """
+    if other is not None and other is not indices:
+        upper = sum(index.count(otherindex) for index, otherindex
+                    in zip(indices.itervalues(), other.itervalues()))
+    else:
+        upper = sum(index.count() for index in indices.itervalues())
+    distinct, pairs, sampled = sample_pairs(
+        records, indices, other, otherrecords, sample, seed)
+    seconds = memory = 0
+    if pairs:
+        start = time.time()
+        vectors = [comparator(a, b) for a, b in pairs]
+        seconds = distinct * (time.time() - start) / len(pairs)
+        memory = int(distinct * sum(
+            _vectorsize(pair, vector) for pair, vector
+            in zip(pairs, vectors)) / len(pairs))
+    result = Estimate(distinct, upper, seconds, memory, sampled)
+    LOG.info("name=EstimateComparisons pairs=%d upper=%d seconds=%.1f "
+             "memory=%d sampled=%d", *result)
+    return result
+
+
+class Budget(object):
+    """Limits on the estimated cost of a linkage.
+
+    :type pairs: :class:`int` or :keyword:`None`
+    :param pairs: Most distinct pairs to compare.
+    :type seconds: :class:`float` or :keyword:`None`
+    :param seconds: Most seconds for comparing the pairs.
+    :type memory: :class:`int` or :keyword:`None`
+    :param memory: Most bytes for the similarity vectors.
+    :type warn: :class:`bool`
+    :param warn: Log a warning instead of raising :exc:`BudgetExceeded`.
+    :type sample: :class:`int`
+    :param sample: Number of records to sample for the :func:`estimate`.
+
+    >>> from dedupe import budget
+    >>> limits = budget.Budget(pairs=100, seconds=60)
+    >>> limits.check(budget.Estimate(50.0, 200, 1.0, 1000, 10))
+    >>> limits.check(budget.Estimate(500.0, 900, 90.0, 1000, 10))
+    Traceback (most recent call last):
+        ...
+    BudgetExceeded: pairs 500 > 100, seconds 90 > 60
+    """
+
+    def __init__(self, pairs=None, seconds=None, memory=None, warn=False,
+                 sample=1000):
+        self.pairs = pairs
+        self.seconds = seconds
+        self.memory = memory
+        self.warn = warn
+        self.sample = sample
+
+    def check(self, result):
+        """Raise :exc:`BudgetExceeded`, or log a warning, if the
+        :class:`Estimate` `result` is over any of the limits."""
+        over = [(name, getattr(result, name), limit)
+                for name, limit in [("pairs", self.pairs),
+                                    ("seconds", self.seconds),
+                                    ("memory", self.memory)]
+                if limit is not None and getattr(result, name) > limit]
+        if not over:
+            return
+        if self.warn:
+            LOG.warning("name=OverBudget %s", " ".join(
+                "{0}={1:.0f} {0}_budget={2}".format(*item) for item in over))
+        else:
+            raise BudgetExceeded(", ".join(
+                "{0} {1:.0f} > {2}".format(*item) for item in over))
+
+    def enforce(self, records, indices, comparator, other=None,
+                otherrecords=None):
+        """:func:`estimate` the cost of comparing the `indices` and
+        :meth:`check` it, returning the :class:`Estimate`."""
+        result = estimate(records, indices, comparator, other, otherrecords,
+                          self.sample)
+        self.check(result)
+        return result
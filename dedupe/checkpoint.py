@@ -0,0 +1,226 @@
+"""Checkpoints of the indexing and comparison stages of a linkage
+
+A checkpoint saves the result of a stage to a binary file together with a
+fingerprint of its inputs: the records, the index strategy and the
+comparator (see :mod:`dedupe.fingerprint`).  Loading a checkpoint returns
+:keyword:`None` unless the fingerprint matches, so that a stage is only
+skipped when its inputs have not changed.
+
+Records are saved by their position in the input list, so the index keys
+are saved as a pickled list per index, and the comparisons as arrays of
+record positions followed by the similarity vectors as doubles, with NaN
+standing for :keyword:`None`.
+"""
+
+from __future__ import with_statement
+
+from array import array
+import cPickle as pickle
+import hashlib
+import logging
+import struct
+
+from dedupe.compat import replace
+import dedupe.fingerprint as fingerprint
+import dedupe.sim as sim
+
+LOG = logging.getLogger('dedupe.checkpoint')
+
+# File header: magic, fingerprint of the inputs, then two counts
+_HEADER = struct.Struct("<8s40sQQ")
+_INDICES = "DDCKIDX1"
+_COMPARISONS = "DDCKCMP1"
+
+
+def key(*parts):
+    """Fingerprint combining the fingerprints in `parts`.
+
+    >>> from dedupe import checkpoint
+    >>> len(checkpoint.key('a', 'b')), checkpoint.key('a', 'b') == \\
+    ...     checkpoint.key('ab')
+    (40, False)
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part)
+        digest.update("\0")
+    return digest.hexdigest()
+
+
+def _readheader(stream, magic, cachekey):
+    """Return the two counts from the header, or :keyword:`None` if the
+    header is not for `magic` and `cachekey`."""
+    header = stream.read(_HEADER.size)
+    if len(header) != _HEADER.size:
+        return None
+    filemagic, filekey, count1, count2 = _HEADER.unpack(header)
+    if filemagic != magic or filekey != cachekey:
+        return None
+    return count1, count2
+
+
+def _replace(path, write):
+    """Call `write` with a stream on a temporary file that then replaces the
+    file at `path`, so that an interrupted save leaves no partial file."""
+    tmppath = path + ".tmp"
+    with open(tmppath, 'wb') as stream:
+        write(stream)
+    replace(tmppath, path)
+
+
+def save_indices(path, cachekey, indices, records):
+    """Save the keys of each of the `records` in each of the `indices`.
+
+    :type path: :class:`str`
+    :param path: Name of the checkpoint file.
+    :type cachekey: :class:`str`
+    :param cachekey: Fingerprint of the records and index strategy.
+    :type indices: :class:`~sim.Indices`
+    :param indices: Indices built from `records`.
+    :type records: [`R`, ...]
+    :param records: Records in the order that they were indexed.
+    """
+    keys = [(name, [sim.getkeys(index, record) for record in records])
+            for name, index in indices.iteritems()]
+    def write(stream):
+        """Write header and pickled keys"""
+        stream.write(_HEADER.pack(_INDICES, cachekey, len(records),
+                                  len(keys)))
+        pickle.dump(keys, stream, pickle.HIGHEST_PROTOCOL)
+    _replace(path, write)
+    LOG.info("name=SaveIndices path=%s records=%s", path, len(records))
+
+
+def load_indices(path, cachekey, strategy, records, keepkeys=False):
+    """Rebuild indices from the keys saved by :func:`save_indices`, without
+    calling the key functions of the `strategy`.
+
+    :type strategy: [ (`str`, `type`, `function`), ... ]
+    :param strategy: Index strategy that the indices were built with.
+    :rtype: :class:`~sim.Indices` or :keyword:`None`
+    :return: The indices, or :keyword:`None` if the checkpoint is missing\
+    or was saved for different inputs.
+
+    >>> import os, tempfile
+    >>> from dedupe import block, checkpoint, sim
+    >>> calls = []
+    >>> makekey = lambda r: calls.append(r) or [int(r[1])]
+    >>> strategy = [("Idx", block.Index, makekey)]
+    >>> records = [('A', 5.5), ('B', 4.5), ('C', 5.25)]
+    >>> indices = sim.Indices(strategy, records)
+    >>> path = os.path.join(tempfile.mkdtemp(), 'indices.ckpt')
+    >>> checkpoint.save_indices(path, '0' * 40, indices, records)
+    >>> del calls[:]
+    >>> checkpoint.load_indices(path, '1' * 40, strategy, records)
+    >>> loaded = checkpoint.load_indices(path, '0' * 40, strategy, records)
+    >>> loaded == indices, calls
+    (True, [])
+    >>> loaded['Idx'].makekey is makekey
+    True
+    >>> os.remove(path)
+    """
+    try:
+        with open(path, 'rb') as stream:
+            counts = _readheader(stream, _INDICES, cachekey)
+            if counts is None or counts[0] != len(records):
+                return None
+            keys = pickle.load(stream)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return None
+    # Build the indices with key functions that replay the saved keys in
+    # the order of the records, then restore the original key functions.
+    replay = [(name, idxtype, lambda record, nextkeys=iter(saved).next:
+               nextkeys())
+              for (name, idxtype, keyfunc), (_, saved)
+              in zip(strategy, keys)]
+    indices = sim.Indices(replay, records, keepkeys)
+    for (name, idxtype, keyfunc), index in zip(strategy,
+                                               indices.itervalues()):
+        if hasattr(index, 'makekey'):
+            index.makekey = keyfunc
+    LOG.info("name=LoadIndices path=%s records=%s", path, len(records))
+    return indices
+
+
+def save_comparisons(path, cachekey, comparisons, records1, records2=None):
+    """Save the similarity vectors of the compared pairs of records.
+
+    :type path: :class:`str`
+    :param path: Name of the checkpoint file.
+    :type cachekey: :class:`str`
+    :param cachekey: Fingerprint of the records, strategy and comparator.
+    :type comparisons: {(`R`, `R`):[:class:`float`, ...], ...}
+    :param comparisons: Similarity vectors of pairs of records.
+    :type records1, records2: [`R`, ...]
+    :param records1, records2: Records on the left and right of the pairs\
+    (`records2` is `records1` by default).
+    """
+    records2 = records2 if records2 else records1
+    position1 = dict((record, i) for i, record in enumerate(records1))
+    position2 = position1 if records2 is records1 else \
+        dict((record, i) for i, record in enumerate(records2))
+    left, right, values = array('l'), array('l'), array('d')
+    dims = 0
+    for (rec1, rec2), vector in comparisons.iteritems():
+        left.append(position1[rec1])
+        right.append(position2[rec2])
+        dims = len(vector)
+        values.extend(float('nan') if v is None else v for v in vector)
+    def write(stream):
+        """Write header, record positions and vectors"""
+        stream.write(_HEADER.pack(_COMPARISONS, cachekey, len(left), dims))
+        left.tofile(stream)
+        right.tofile(stream)
+        values.tofile(stream)
+    _replace(path, write)
+    LOG.info("name=SaveComparisons path=%s pairs=%s", path, len(left))
+
+
+def load_comparisons(path, cachekey, comparator, records1, records2=None):
+    """Load the comparisons saved by :func:`save_comparisons`.
+
+    :type comparator: :class:`~sim.Record`
+    :param comparator: Comparator of the records, for the type of the\
+    similarity vectors.
+    :rtype: {(`R`, `R`):[:class:`float`, ...], ...} or :keyword:`None`
+    :return: The comparisons, or :keyword:`None` if the checkpoint is\
+    missing or was saved for different inputs.
+
+    >>> import os, tempfile
+    >>> from dedupe import checkpoint, sim
+    >>> comparator = sim.Record(("V", sim.Field(lambda x, y: x == y, 0)))
+    >>> records = [('A',), ('B',), ('C',)]
+    >>> comparisons = {(('A',), ('B',)): comparator.Similarity(0.5),
+    ...                (('A',), ('C',)): comparator.Similarity(None)}
+    >>> path = os.path.join(tempfile.mkdtemp(), 'comparisons.ckpt')
+    >>> checkpoint.save_comparisons(path, '0' * 40, comparisons, records)
+    >>> loaded = checkpoint.load_comparisons(
+    ...     path, '0' * 40, comparator, records)
+    >>> loaded == comparisons
+    True
+    >>> loaded[(('A',), ('C',))]
+    Similarity(V=None)
+    >>> os.remove(path)
+    """
+    records2 = records2 if records2 else records1
+    try:
+        with open(path, 'rb') as stream:
+            counts = _readheader(stream, _COMPARISONS, cachekey)
+            if counts is None:
+                return None
+            npairs, dims = counts
+            left, right, values = array('l'), array('l'), array('d')
+            left.fromfile(stream, npairs)
+            right.fromfile(stream, npairs)
+            values.fromfile(stream, npairs * dims)
+    except (IOError, EOFError):
+        return None
+    make = getattr(comparator, 'Similarity', tuple)
+    make = getattr(make, '_make', make)
+    comparisons = {}
+    for i in xrange(npairs):
+        # NaN is the only value not equal to itself, and stands for None
+        comparisons[(records1[left[i]], records2[right[i]])] = make(
+            None if v != v else v for v in values[i * dims:(i + 1) * dims])
+    LOG.info("name=LoadComparisons path=%s pairs=%s", path, npairs)
+    return comparisons
@@ -11,8 +11,14 @@ non-match example in nearest-neighbour classification.  Dropping a missing
 similarity from the distance calculation excludes it from the decision.
 """
 
+import functools
 import math
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 def L2(vec1, vec2):
     """Return L2 Euclidian distance between two vectors.
@@ -80,3 +86,124 @@ def normL2(vec1, vec2, stdevs):
     return math.sqrt(sum(((a - b) / s) ** 2
                          for a, b, s in zip(vec1, vec2, stdevs)
                          if a is not None and b is not None))
+
+
+def matrix(vecs):
+    """Prepare a list of vectors for the one-to-many distance functions.
+
+    With NumPy available this is a 2-D float array in which `None` components
+    are NaN, so converting once and passing the result to repeated
+    :func:`L2_many` calls avoids converting on every call.  Without NumPy the
+    vectors are returned as a list.
+
+    :type vecs: [[:class:`float` | :keyword:`None`, ...], ...]
+    :param vecs: Nullable floating-point vectors of the same length.
+    """
+    if numpy is None:
+        return list(vecs)
+    if isinstance(vecs, numpy.ndarray):
+        return vecs
+    return numpy.array(list(vecs), dtype=float, ndmin=2)
+
+
+def _sqdiff(vec, vecs, stdevs=None):
+    """Squared (and optionally normalised) differences of `vec` against
+    each row of the NumPy matrix `vecs`, with zero for NaN components."""
+    diff = vecs - numpy.array(vec, dtype=float)
+    if stdevs is not None:
+        diff /= numpy.array(stdevs, dtype=float)
+    diff *= diff
+    diff[numpy.isnan(diff)] = 0.0
+    return diff
+
+
+def L2_many(vec, vecs):
+    """Return the :func:`L2` distance from `vec` to each of `vecs`.
+
+    :type vec: [:class:`float` | :keyword:`None`, ...]
+    :param vec: Nullable floating-point vector.
+    :type vecs: [[:class:`float` | :keyword:`None`, ...], ...]
+    :param vecs: Vectors of the same length, or a :func:`matrix` of them.
+    :rtype: [:class:`float`, ...]
+    :return: Distances in the order of `vecs`.
+
+    >>> from dedupe.classification.distance import L2_many
+    >>> L2_many([2, None], [[5, None], [5, 1], [2, 2]])
+    [3.0, 3.0, 0.0]
+    """
+    if len(vecs) == 0:
+        return []
+    if numpy is None:
+        return [L2(vec, other) for other in vecs]
+    return numpy.sqrt(_sqdiff(vec, matrix(vecs)).sum(axis=1)).tolist()
+
+
+def normL2_many(vec, vecs, stdevs):
+    """Return the :func:`normL2` distance from `vec` to each of `vecs`.
+
+    >>> from dedupe.classification.distance import normL2_many
+    >>> normL2_many([2, 2], [[3, 3], [2, None]], [0.5, 1]) == [5**0.5, 0.0]
+    True
+    """
+    if len(vecs) == 0:
+        return []
+    if numpy is None:
+        return [normL2(vec, other, stdevs) for other in vecs]
+    return numpy.sqrt(_sqdiff(vec, matrix(vecs), stdevs).sum(axis=1)).tolist()
+
+
+def L2_pairwise(vecs1, vecs2):
+    """Return the matrix of :func:`L2` distances, where row `i` holds the
+    distances from `vecs1[i]` to each of `vecs2`.
+
+    >>> from dedupe.classification.distance import L2_pairwise
+    >>> L2_pairwise([[0, 0], [3, None]], [[3, 4], [0, 0]])
+    [[5.0, 0.0], [0.0, 3.0]]
+    """
+    vecs2 = matrix(vecs2)
+    return [L2_many(vec, vecs2) for vec in vecs1]
+
+
+def normL2_pairwise(vecs1, vecs2, stdevs):
+    """Return the matrix of :func:`normL2` distances, where row `i` holds
+    the distances from `vecs1[i]` to each of `vecs2`."""
+    vecs2 = matrix(vecs2)
+    return [normL2_many(vec, vecs2, stdevs) for vec in vecs1]
+
+
+def many(distance):
+    """Return a one-to-many form of the pairwise `distance` function, taking
+    a vector and a list (or :func:`matrix`) of vectors and returning the list
+    of distances.
+
+    :func:`L2` and :func:`normL2` bound with :func:`functools.partial` map
+    onto the vectorised :func:`L2_many` and :func:`normL2_many`.  Other
+    functions use their own `many` attribute if they have one, or else get
+    called once per vector.
+
+    >>> from functools import partial
+    >>> from dedupe.classification import distance
+    >>> distance.many(distance.L2) is distance.L2_many
+    True
+    >>> distance.many(partial(distance.normL2, stdevs=[1]))([1], [[2], [4]])
+    [1.0, 3.0]
+    >>> distance.many(lambda a, b: abs(a[0] - b[0]))([1], [[2], [4]])
+    [1, 3]
+    """
+    if distance is L2:
+        return L2_many
+    if (isinstance(distance, functools.partial) and distance.func is normL2
+        and not distance.args and distance.keywords
+        and distance.keywords.keys() == ['stdevs']):
+        stdevs = distance.keywords['stdevs']
+        return lambda vec, vecs: normL2_many(vec, vecs, stdevs)
+    if hasattr(distance, 'many'):
+        return distance.many
+
+    def one_to_many(vec, vecs):
+        """Call the pairwise distance function once per vector."""
+        if numpy is not None and isinstance(vecs, numpy.ndarray):
+            vecs = [[None if x != x else x for x in row]
+                    for row in vecs.tolist()]
+        return [distance(vec, other) for other in vecs]
+    return one_to_many
@@ -1,13 +1,89 @@
 """Convert example pairs into training vectors"""
 
+from array import array
+from collections import defaultdict
+from itertools import combinations
 from os.path import join
 from contextlib import nested
+import hashlib
+import logging
+import struct
 import dedupe.block as block
+import dedupe.fingerprint as fingerprint
 import dedupe.sim as sim
 from dedupe.linkcsv import write_comparisons
 
+LOG = logging.getLogger('dedupe.examples')
 
-def load(comparator, records, outdir=None):
+# Cache file header: magic, fingerprint, vector length, true and false counts
+_HEADER = struct.Struct("<8s40sIII")
+_MAGIC = "DDEXVEC1"
+
+# Values of the first field marking true and false examples
+_TRUE = ['TRUE', 'T', 'YES', 'Y', '1', 1, True]
+_FALSE = ['FALSE', 'F', 'NO', 'N', '0', 0, False]
+
+
+def _cachekey(comparator, records):
+    """Fingerprint of the example records and the comparator definition."""
+    return hashlib.sha1(fingerprint.records(records) +
+                        fingerprint.definition(comparator)).hexdigest()
+
+
+def _readcache(path, key, comparator):
+    """Return the true and false vectors from the cache at `path`, or
+    :keyword:`None` if it is missing or was computed for a different key."""
+    try:
+        with open(path, 'rb') as stream:
+            magic, cachekey, dims, ntrue, nfalse = _HEADER.unpack(
+                stream.read(_HEADER.size))
+            if magic != _MAGIC or cachekey != key:
+                return None
+            values = array('d')
+            values.fromfile(stream, dims * (ntrue + nfalse))
+    except (IOError, EOFError, struct.error):
+        return None
+    if dims == 0:
+        # only vectors of no fields can be cached without any values
+        return ([], []) if ntrue + nfalse == 0 else None
+    make = getattr(comparator, 'Similarity', tuple)
+    make = getattr(make, '_make', make)
+    # NaN is the only value not equal to itself, and stands for None
+    vectors = [make(None if v != v else v for v in values[i:i + dims])
+               for i in xrange(0, len(values), dims)]
+    return vectors[:ntrue], vectors[ntrue:]
+
+
+def _writecache(path, key, t_vecs, f_vecs):
+    """Save the true and false vectors to the cache at `path`."""
+    vecs = t_vecs + f_vecs
+    dims = len(vecs[0]) if vecs else 0
+    values = array('d', (float('nan') if v is None else v
+                         for vec in vecs for v in vec))
+    with open(path, 'wb') as stream:
+        stream.write(_HEADER.pack(_MAGIC, key, dims, len(t_vecs), len(f_vecs)))
+        values.tofile(stream)
+
+
+def matchpairs(records):
+    """Pairs of the true example `records` that share the key in their
+    second field, which are the pairs that :func:`load` compares for the
+    match vectors.
+
+    >>> from dedupe.classification import examples
+    >>> examples.matchpairs([('TRUE', '1', 'Joe1'), ('FALSE', '1', 'Joe2'),
+    ...                      ('TRUE', '1', 'Joe3'), ('TRUE', '2', 'Abe')])
+    [(('TRUE', '1', 'Joe1'), ('TRUE', '1', 'Joe3'))]
+    """
+    groups = defaultdict(list)
+    for record in records:
+        if record[0] in _TRUE:
+            groups[record[1]].append(record)
+    return [pair for key in sorted(groups)
+            for pair in combinations(groups[key], 2)]
+
+
+def load(comparator, records, outdir=None, cache=None):
     """Use example records to create match and non-match similarity vectors
     for training a classifier.
 
@@ -26,6 +102,12 @@ def load(comparator, records, outdir=None):
     :type outdir: :class:`str`
     :param outdir: optional debug para to, write comparisons as CSV to\
        :file:`{outdir}/{foo}_true.csv` and :file:`{outdir}/{foo}_false.csv`.
+    :type cache: :class:`str`
+    :param cache: optional path of a binary file caching the similarity\
+       vectors.  The cached vectors are returned when the records and the\
+       definition of the `comparator` are unchanged, otherwise the vectors\
+       are recomputed and saved.  The debug CSV files need the record pairs,\
+       so they are only written when the vectors are recomputed.
     :rtype: {[:class:`float`, ...], ...}, {[:class:`float`, ...], ...}
     :return: similarity vectors of the true comparisons and false comparisons.
 
@@ -58,11 +140,27 @@ def load(comparator, records, outdir=None):
  ',1,7', ',1,3', '1.0,True,0.0625',\
  ',1,8', ',1,7', '1.0,True,0.5',\
  ',2,3', ',2,5', '1.0,True,0.25']
+    >>> del examples.open # restore the real open
+    >>> import os, tempfile
+    >>> cache = os.path.join(tempfile.mkdtemp(), 'examples.bin')
+    >>> t, f = examples.load(comparator, records, cache=cache)
+    >>> examples.load(comparator, records, cache=cache) == (t, f)
+    True
+    >>> examples.load(comparator, records[-1:], cache=cache)
+    ([], [])
+    >>> examples.load(comparator, records[-1:], cache=cache)
+    ([], [])
+    >>> os.remove(cache)
     """
-    t_rows = [r for r in records if r[0] in
-              ['TRUE', 'T', 'YES', 'Y', '1', 1, True]]
-    f_rows = [r for r in records if r[0] in
-              ['FALSE', 'F', 'NO', 'N', '0', 0, False]]
+    if cache:
+        key = _cachekey(comparator, records)
+        vectors = _readcache(cache, key, comparator)
+        if vectors is not None:
+            LOG.info("name=ExampleCache path=%s true=%s false=%s",
+                     cache, len(vectors[0]), len(vectors[1]))
+            return vectors
+    t_rows = [r for r in records if r[0] in _TRUE]
+    f_rows = [r for r in records if r[0] in _FALSE]
     # Index on second column and self-compare within blocks
     t_indices = sim.Indices([("Key", block.Index, lambda r: [r[1]])], t_rows)
     f_indices = sim.Indices([("Key", block.Index, lambda r: [r[1]])], f_rows)
@@ -77,4 +175,6 @@ def load(comparator, records, outdir=None):
             f_scores = dict((p, 0.0) for p in f_sims.iterkeys())
             write_comparisons(o_true, comparator, t_sims, t_scores, t_indices)
             write_comparisons(o_false, comparator, f_sims, f_scores, f_indices)
+    if cache:
+        _writecache(cache, key, t_sims.values(), f_sims.values())
     return t_sims.values(), f_sims.values()
@@ -11,6 +11,8 @@ from __future__ import division
 import logging
 import math
 
+from dedupe.classification.distance import many, matrix
+
 LOG = logging.getLogger('dedupe.kmeans')
 
 
@@ -28,7 +30,8 @@ def classify(comparisons, distance, maxiter=10):
     :type comparisons: {(`R`, `R`):[:class:`float`, ...], ...}
     :param comparisons: similarity vectors of compared record pairs.
     :type distance: function([`float`, ...], [`float`, ...]) `float`
-    :param distance: calculates distance between similarity vectors.
+    :param distance: calculates distance between similarity vectors,\
+    vectorised over all comparisons by :func:`~distance.many`.
     :type maxiter: :class:`int`
     :param maxiter: maximum number of loops to adjust the centroid
     :rtype: {(`R`, `R`): `float`}, {(`R`, `R`): `float`}
@@ -79,6 +82,11 @@ def classify(comparisons, distance, maxiter=10):
     # Mapping key to (value, class assignment).
     # All items initially assigned to the "False" class (non-match).
     assignments = dict((k, [v, False]) for k, v in comparisons.iteritems())
+    # Convert the vectors once for the one-to-many distance function
+    keys = assignments.keys()
+    vectors = [assignments[k][0] for k in keys]
+    vmatrix = matrix(vectors)
+    distances = many(distance)
     # Number of items that changed class
     n_changed = 1
     # Number of classifier iterations
@@ -96,9 +104,11 @@ def classify(comparisons, distance, maxiter=10):
         low_count = [0] * vlen
 
         # Now assign the vectors to centroids
-        for k, (v, match) in assignments.iteritems():
-            dist_high = distance(v, high_centroid)
-            dist_low = distance(v, low_centroid)
+        dists_high = distances(high_centroid, vmatrix)
+        dists_low = distances(low_centroid, vmatrix)
+        for k, v, dist_high, dist_low in zip(
+            keys, vectors, dists_high, dists_low):
+            match = assignments[k][1]
             if dist_high < dist_low:
                 if not match:
                     n_changed += 1
@@ -125,12 +135,15 @@ def classify(comparisons, distance, maxiter=10):
 
     # Calculate a smoothed score as the log of the ratio of distances
     # of the similarity vector to each of the centroids.
-    score = lambda v: math.log10((distance(v, low_centroid) + 0.1)
-                                  / (distance(v, high_centroid) + 0.1))
-    matches = dict((k, score(v))  for k, (v, match)
-                   in assignments.iteritems() if match)
-    nomatches = dict((k, score(v)) for k, (v, match)
-                     in assignments.iteritems() if not match)
+    dists_high = distances(high_centroid, vmatrix)
+    dists_low = distances(low_centroid, vmatrix)
+    matches, nomatches = {}, {}
+    for k, dist_high, dist_low in zip(keys, dists_high, dists_low):
+        score = math.log10((dist_low + 0.1) / (dist_high + 0.1))
+        if assignments[k][1]:
+            matches[k] = score
+        else:
+            nomatches[k] = score
     LOG.debug("name=KMeansFinished comparisons=%s, matches=%s, nonmatches=%s",
               len(comparisons), len(matches), len(nomatches))
     return matches, nomatches
@@ -9,9 +9,22 @@ example vector is a match or a non-match.
 import logging
 import math
 
+from dedupe.classification.distance import many, matrix
+
 LOG = logging.getLogger(__name__)
 
 
+def _mindist(distances, examples, vmatrix, count):
+    """Distance from each of `count` vectors in `vmatrix` to the nearest of
+    the `examples`, using the one-to-many `distances` function."""
+    if count == 0:
+        return []
+    nearest = [float('inf')] * count
+    for example in examples:
+        nearest = map(min, nearest, distances(example, vmatrix))
+    return nearest
+
+
 def classify(comparisons, ex_matches, ex_nonmatches, distance, rule=None):
     """Nearest-neighbour classification of comparisons vectors.
 
@@ -60,20 +73,12 @@ def classify(comparisons, ex_matches, ex_nonmatches, distance, rule=None):
     LOG.debug("name=ExampleCounts match=%s nonmatch=%s",
               len(ex_matches), len(ex_nonmatches))
     matches, nonmatches = {}, {}
+    # Pairs left undecided by the rule go to the nearest-neighbour algorithm
+    undecided = []
     for pair, comparison in comparisons.iteritems():
         judge = rule(pair[0], pair[1], comparison) if rule else None
         if judge is None:
-            match_dist = min(distance(comparison, example)
-                             for example in ex_matches)
-            nonmatch_dist = min(distance(comparison, example)
-                                for example in ex_nonmatches)
-            # Calculate a smoothed score as the log of the ratio of distances
-            # of the similarity vector to the nearest match and non-match.
-            score = math.log10((nonmatch_dist + 0.1) / (match_dist + 0.1))
-            if match_dist < nonmatch_dist:
-                matches[pair] = score
-            else:
-                nonmatches[pair] = score
+            undecided.append(pair)
         elif judge is True:
             matches[pair] = 1.0
         elif judge is False:
@@ -81,6 +86,21 @@ def classify(comparisons, ex_matches, ex_nonmatches, distance, rule=None):
         else:
             raise ValueError(
                 "rule returned {0!s}: should be True/False/None".format(judge))
+    # Distance from each example to all undecided vectors at once
+    distances = many(distance)
+    vmatrix = matrix([comparisons[pair] for pair in undecided])
+    match_dists = _mindist(distances, ex_matches, vmatrix, len(undecided))
+    nonmatch_dists = _mindist(
+        distances, ex_nonmatches, vmatrix, len(undecided))
+    for pair, match_dist, nonmatch_dist in zip(
+        undecided, match_dists, nonmatch_dists):
+        # Calculate a smoothed score as the log of the ratio of distances
+        # of the similarity vector to the nearest match and non-match.
+        score = math.log10((nonmatch_dist + 0.1) / (match_dist + 0.1))
+        if match_dist < nonmatch_dist:
+            matches[pair] = score
+        else:
+            nonmatches[pair] = score
     LOG.debug("name=NearestNeighbourResult matches=%s nonmatches=%s",
               len(matches), len(nonmatches))
     return matches, nonmatches
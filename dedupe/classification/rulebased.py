@@ -3,11 +3,285 @@
 Uses a function of the similarity vector to determine match or non-match.  Note
 that Nearest-Neighbour classifier allows an override rule to assist
 classification.
+
+Rules that are only thresholds on named fields of the similarity vector can be
+written as a :class:`Rule` expression, which is compiled once and can also
+classify a whole list of similarity vectors at once.
 """
 import logging
+import operator
+import re
+
+from dedupe.classification.distance import matrix, numpy
 
 LOG = logging.getLogger('dedupe.rulebased')
 
+_OPERATORS = {
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+    '==': operator.eq, '!=': operator.ne}
+
+_TOKEN = re.compile(r"""\s*(?:
+    (?P<number>\d+(?:\.\d*)?|\.\d+)
+  | (?P<op><=|>=|==|!=|<|>)
+  | (?P<paren>[()])
+  | (?P<name>[A-Za-z_]\w*)
+  )""", re.VERBOSE)
+
+
+def _tokenize(text):
+    """Split rule `text` into a list of (kind, value) tokens."""
+    tokens, pos, text = [], 0, text.rstrip()
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if match is None:
+            raise ValueError("{0!r}: bad rule syntax at {1!r}".format(
+                text, text[pos:]))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'name' and value in ('and', 'or', 'not'):
+            kind = value
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+class _Parser(object):
+    """Recursive-descent parser from rule text to a tree of tuples:
+    ('cmp', field, op, number), ('and', a, b), ('or', a, b), ('not', a)."""
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def error(self, expected):
+        """Raise ValueError for an unexpected token."""
+        found = self.tokens[self.pos][1] if self.pos < len(self.tokens)\
+                else "end of rule"
+        raise ValueError("{0!r}: expected {1}, found {2!r}".format(
+            self.text, expected, found))
+
+    def take(self, kind):
+        """Consume and return the value of the next token if it is `kind`."""
+        if self.pos < len(self.tokens) and self.tokens[self.pos][0] == kind:
+            self.pos += 1
+            return self.tokens[self.pos - 1][1]
+        return None
+
+    def parse(self):
+        """Parse the whole rule."""
+        tree = self.disjunction()
+        if self.pos != len(self.tokens):
+            self.error("'and' or 'or'")
+        return tree
+
+    def disjunction(self):
+        """Parse: conjunction ('or' conjunction)*"""
+        tree = self.conjunction()
+        while self.take('or'):
+            tree = ('or', tree, self.conjunction())
+        return tree
+
+    def conjunction(self):
+        """Parse: negation ('and' negation)*"""
+        tree = self.negation()
+        while self.take('and'):
+            tree = ('and', tree, self.negation())
+        return tree
+
+    def negation(self):
+        """Parse: 'not' negation | '(' disjunction ')' | name op number"""
+        if self.take('not'):
+            return ('not', self.negation())
+        if self.take('paren') == '(':
+            tree = self.disjunction()
+            if self.take('paren') != ')':
+                self.error("')'")
+            return tree
+        field = self.take('name')
+        if field is None:
+            self.error("a field name")
+        op = self.take('op')
+        if op is None:
+            self.error("a comparison operator")
+        number = self.take('number')
+        if number is None:
+            self.error("a number")
+        return ('cmp', field, op, float(number))
+
+
+def _closure(tree, positions):
+    """Compile `tree` into a function of a similarity vector returning
+    True/False/None, looking up fields by their `positions`."""
+    kind = tree[0]
+    if kind == 'cmp':
+        _, field, op, number = tree
+        pos, compare = positions[field], _OPERATORS[op]
+
+        def cmp_(vec):
+            """Compare a field to the threshold, unknown if missing."""
+            value = vec[pos]
+            return None if value is None else bool(compare(value, number))
+        return cmp_
+    elif kind == 'not':
+        arg = _closure(tree[1], positions)
+
+        def not_(vec):
+            """Negate, keeping unknown."""
+            value = arg(vec)
+            return None if value is None else not value
+        return not_
+    left = _closure(tree[1], positions)
+    right = _closure(tree[2], positions)
+    # 'and' is decided by a False operand, 'or' by a True operand
+    decider = kind == 'or'
+
+    def junction(vec):
+        """Three-valued (Kleene) and/or."""
+        value1 = left(vec)
+        if value1 is decider:
+            return decider
+        value2 = right(vec)
+        if value2 is decider:
+            return decider
+        if value1 is None or value2 is None:
+            return None
+        return not decider
+    return junction
+
+
+def _masks(tree, vecs, positions):
+    """Evaluate `tree` over the NumPy :func:`~distance.matrix` `vecs`,
+    returning boolean arrays for rows that are True and rows that are False.
+    Rows that are neither are unknown."""
+    kind = tree[0]
+    if kind == 'cmp':
+        _, field, op, number = tree
+        column = vecs[:, positions[field]]
+        known = ~numpy.isnan(column)
+        with numpy.errstate(invalid='ignore'):
+            result = _OPERATORS[op](column, number)
+        return result & known, ~result & known
+    elif kind == 'not':
+        true, false = _masks(tree[1], vecs, positions)
+        return false, true
+    true1, false1 = _masks(tree[1], vecs, positions)
+    true2, false2 = _masks(tree[2], vecs, positions)
+    if kind == 'and':
+        return true1 & true2, false1 | false2
+    else:
+        return true1 | true2, false1 & false2
+
+
+def _fieldnames(tree):
+    """Set of field names used in `tree`."""
+    if tree[0] == 'cmp':
+        return set([tree[1]])
+    return set().union(*[_fieldnames(arg) for arg in tree[1:]])
+
+
+class Rule(object):
+    """Match rule given as thresholds on named fields of the similarity
+    vector, combined with `and`, `or`, `not` and parentheses.  Comparison
+    operators are ``< <= > >= == !=`` against a number.
+
+    The rule is true, false, or :keyword:`None` when unknown.  A comparison
+    on a `None` similarity is unknown, `and` is false if either side is false
+    and `or` is true if either side is true, otherwise unknown propagates.
+
+    Calling the rule has the `rule(rec1, rec2, simvec)` signature used by
+    :func:`classify_bool`, :func:`classify` and :func:`~nearest.classify`.
+    The rule compiles to a Python closure for each field ordering, and
+    :meth:`masks` evaluates it over many similarity vectors at once.
+
+    :type text: :class:`str`
+    :param text: The rule expression.
+    :type fields: [:class:`str`, ...] or :keyword:`None`
+    :param fields: Field names of the similarity vectors, if they are not\
+    namedtuples like the :attr:`~sim.Record.Similarity` vectors.
+
+    >>> from collections import namedtuple
+    >>> from dedupe.classification.rulebased import Rule
+    >>> Similarity = namedtuple('Similarity', 'Name Phone Geo')
+    >>> rule = Rule("Name >= 0.9 and (Phone >= 0.8 or Geo == 1.0)")
+    >>> rule(None, None, Similarity(0.95, 0.5, 1.0))
+    True
+    >>> rule(None, None, Similarity(0.95, 0.5, 0.5))
+    False
+    >>> print rule(None, None, Similarity(0.95, None, 0.5))
+    None
+    >>> rule(None, None, Similarity(0.5, None, None))
+    False
+    >>> Rule("not Name < 0.5", fields=['Name'])(None, None, [0.7])
+    True
+    >>> rule.masks([Similarity(0.95, 0.9, None), Similarity(0.95, None, 0.5),
+    ...             Similarity(0.1, None, None)])
+    ([True, False, False], [False, False, True])
+    >>> Rule("Name >= 0.9 and")
+    Traceback (most recent call last):
+        ...
+    ValueError: 'Name >= 0.9 and': expected a field name, found 'end of rule'
+    """
+
+    def __init__(self, text, fields=None):
+        self.text = text
+        self.tree = _Parser(text).parse()
+        self.fields = tuple(fields) if fields is not None else None
+        self.compiled = {}
+
+    def __repr__(self):
+        return "Rule({0!r})".format(self.text)
+
+    def _positions(self, fields):
+        """Map field names used by the rule to positions in `fields`."""
+        positions = dict((name, pos) for pos, name in enumerate(fields))
+        for name in _fieldnames(self.tree):
+            if name not in positions:
+                raise ValueError("{0!r}: no field {1!r} in {2!r}".format(
+                    self.text, name, fields))
+        return positions
+
+    def _fieldsof(self, simvec):
+        """Field names of a similarity vector."""
+        fields = getattr(simvec, '_fields', self.fields)
+        if fields is None:
+            raise ValueError("{0!r}: field names of {1!r} are unknown".format(
+                self.text, simvec))
+        return fields
+
+    def compile(self, fields):
+        """Return the closure evaluating this rule on similarity vectors
+        having the given field names."""
+        fields = tuple(fields)
+        if fields not in self.compiled:
+            self.compiled[fields] = _closure(
+                self.tree, self._positions(fields))
+        return self.compiled[fields]
+
+    def __call__(self, rec1, rec2, simvec):
+        return self.compile(self._fieldsof(simvec))(simvec)
+
+    def masks(self, simvecs):
+        """Evaluate the rule on a list of similarity vectors.
+
+        :type simvecs: [[:class:`float` | :keyword:`None`, ...], ...]
+        :param simvecs: Similarity vectors having the same fields.
+        :rtype: [:class:`bool`, ...], [:class:`bool`, ...]
+        :return: Whether each vector makes the rule true, and whether it\
+        makes the rule false.  Unknown vectors are neither.
+        """
+        if len(simvecs) == 0:
+            return [], []
+        fields = self._fieldsof(simvecs[0])
+        if numpy is None:
+            closure = self.compile(fields)
+            results = [closure(simvec) for simvec in simvecs]
+            return ([result is True for result in results],
+                    [result is False for result in results])
+        true, false = _masks(
+            self.tree, matrix(simvecs), self._positions(fields))
+        return true.tolist(), false.tolist()
+
 
 def classify_bool(rule, comparisons):
     """Use provided rule to classify similarity vectors as
@@ -20,7 +294,17 @@ def classify_bool(rule, comparisons):
     :param comparisons: similarity vectors of compared record pairs.
     :rtype: {(`R`, `R`) ...}, {(`R`, `R`) ...}, {(`R`, `R`) ...}
     :return: sets of matching, non-matching and uncertain record pairs
+
+    A :class:`Rule` classifies all the similarity vectors at once:
+
+    >>> from dedupe.classification import rulebased
+    >>> comparisons = {(1, 2): [0.9], (2, 3): [0.2], (3, 4): [None]}
+    >>> rule = rulebased.Rule("Name > 0.5", fields=['Name'])
+    >>> rulebased.classify_bool(rule, comparisons)
+    (set([(1, 2)]), set([(2, 3)]), set([(3, 4)]))
     """
+    if isinstance(rule, Rule):
+        return _classify_masks(rule, comparisons)
     matches, nonmatches, uncertain = set(), set(), set()
     for pair, simvec in comparisons.iteritems():
         ismatch = rule(pair[0], pair[1], simvec)
@@ -38,6 +322,23 @@ def classify_bool(rule, comparisons):
     return matches, nonmatches, uncertain
 
 
+def _classify_masks(rule, comparisons):
+    """Classify with the vectorised :meth:`Rule.masks`."""
+    pairs = comparisons.keys()
+    true, false = rule.masks([comparisons[pair] for pair in pairs])
+    matches, nonmatches, uncertain = set(), set(), set()
+    for pair, istrue, isfalse in zip(pairs, true, false):
+        if istrue:
+            matches.add(pair)
+        elif isfalse:
+            nonmatches.add(pair)
+        else:
+            uncertain.add(pair)
+    LOG.debug("name=Results compares=%s matches=%s nonmatch=%s uncertain=%s",
+              len(comparisons), len(matches), len(nonmatches), len(uncertain))
+    return matches, nonmatches, uncertain
+
+
 def classify(rule, comparisons):
     """Uses a rule to classify matches/non-matches using scores of 0.0 and
     1.0, which is the format produced by :mod:`~classification.kmeans` and
@@ -1,6 +1,32 @@
-"""Compatibility for Python 2.6"""
+"""Compatibility for Python 2.6 and for Windows"""
+
+import os
 
 try:
     from collections import OrderedDict  # pylint: disable=E0611
 except ImportError:
     from dedupe.compat._ordereddict import OrderedDict
+
+
+def replace(src, dst):
+    """Rename file `src` to `dst`, replacing `dst` if it exists, which
+    :func:`os.rename` does not do on Windows.
+
+    >>> import os, tempfile
+    >>> from dedupe.compat import replace
+    >>> tmpdir = tempfile.mkdtemp()
+    >>> src, dst = os.path.join(tmpdir, 'a'), os.path.join(tmpdir, 'b')
+    >>> for path, text in [(src, 'new'), (dst, 'old')]:
+    ...     open(path, 'w').write(text)
+    >>> replace(src, dst)
+    >>> open(dst).read(), os.path.exists(src)
+    ('new', False)
+    >>> os.remove(dst)
+    """
+    try:
+        os.rename(src, dst)
+    except OSError:
+        if not os.path.exists(dst):
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
@@ -13,8 +13,26 @@ with no heading, a 'fields' parameter is used to construct the namedtuple.
 from __future__ import with_statement
 from __future__ import absolute_import
 
+import bz2
 import csv as plaincsv
+from array import array
 from collections import namedtuple
+from cStringIO import StringIO
+import gzip
+import io
+from itertools import islice
+import multiprocessing
+from operator import itemgetter
+import os
+import time
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 
 
 def _fake_open(module):
@@ -35,11 +53,131 @@ def _fake_open(module):
     return streams
 
 
+def compression(path):
+    """Compression format of a file by its extension: 'gz', 'bz2', 'xz' or
+    :keyword:`None` for plain files.
+
+    >>> from dedupe import csv
+    >>> csv.compression('records.csv.gz'), csv.compression('records.csv')
+    ('gz', None)
+    """
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    return extension if extension in ('gz', 'bz2', 'xz') else None
+
+
+def openfile(path, mode='rb', level=None, bufsize=2 ** 16, opener=open):
+    """Open a file for streaming, compressing or decompressing it on the fly
+    when the name ends in .gz, .bz2 or .xz (the last requires the `lzma`
+    module, from :mod:`backports.lzma` on Python 2).
+
+    :type path: :class:`str`
+    :param path: Name of the file.
+    :type mode: :class:`str`
+    :param mode: 'rb' to read, 'wb' to write.
+    :type level: :class:`int` or :keyword:`None`
+    :param level: Compression level (1 fastest to 9 smallest), by default\
+    that of the format.
+    :type bufsize: :class:`int`
+    :param bufsize: Size of the buffer between the stream and the\
+    compressor.
+    :param opener: Function to open plain files with a path and mode.
+
+    >>> import os, tempfile
+    >>> from dedupe import csv
+    >>> path = os.path.join(tempfile.mkdtemp(), 'records.csv.gz')
+    >>> with csv.openfile(path, 'wb', level=1) as stream:
+    ...     csv.Writer(stream).writerows([[u'A', u'B'], [u'1', u'2']])
+    >>> with csv.openfile(path) as stream:
+    ...     list(csv.Reader(stream))
+    [Row(A=u'1', B=u'2')]
+    >>> list(csv.Reader(path))
+    [Row(A=u'1', B=u'2')]
+    >>> os.remove(path)
+    """
+    kind = compression(path)
+    if kind is None:
+        return opener(path, mode)
+    if kind == 'bz2':
+        return bz2.BZ2File(path, mode, bufsize, 9 if level is None else level)
+    if kind == 'gz':
+        stream = gzip.GzipFile(path, mode, 6 if level is None else level)
+    elif lzma is None:
+        raise IOError("{0}: xz compression requires backports.lzma".format(
+            path))
+    elif 'r' in mode:
+        stream = lzma.LZMAFile(path, mode)
+    else:
+        stream = lzma.LZMAFile(path, mode, preset=level)
+    if 'r' in mode:
+        return io.BufferedReader(stream, bufsize)
+    return io.BufferedWriter(stream, bufsize)
+
+
+def benchmark(path, formats=('gz', 'bz2', 'xz'), levels=(1, 6, 9)):
+    """Compare the disk space against CPU time of compressing the CSV file
+    at `path` with each of the `formats` and `levels`, by writing the
+    records to a temporary file and reading them back.
+
+    :rtype: [(:class:`str`, :class:`int`, :class:`int`, :class:`float`,\
+    :class:`float`), ...]
+    :return: Format (:keyword:`None` for plain CSV), level, bytes on disk,\
+    and CPU seconds to write and to read for each combination.  Formats\
+    that are not available are skipped.
+
+    >>> import os, tempfile
+    >>> from dedupe import csv
+    >>> path = os.path.join(tempfile.mkdtemp(), 'records.csv')
+    >>> with open(path, 'wb') as out:
+    ...     out.write('A,B\\r\\n' + 'abc,def\\r\\n' * 100)
+    >>> results = csv.benchmark(path, formats=('gz',), levels=(1,))
+    >>> [(kind, level) for kind, level, _, _, _ in results]
+    [(None, None), ('gz', 1)]
+    >>> results[1][2] < results[0][2]
+    True
+    >>> os.remove(path)
+    """
+    with open(path, 'rb') as stream:
+        rows = list(Reader(stream).batches())
+    tmpdir = os.path.dirname(os.path.abspath(path))
+    results = []
+    combos = [(None, None)] + [(kind, level) for kind in formats
+                               for level in levels
+                               if kind != 'xz' or lzma is not None]
+    for kind, level in combos:
+        tmppath = os.path.join(tmpdir, ".benchmark.csv" +
+                               ("." + kind if kind else ""))
+        try:
+            start = time.clock()
+            with openfile(tmppath, 'wb', level) as stream:
+                writer = Writer(stream, encoding='utf-8')
+                writer.writerow(rows[0][0]._fields if rows and rows[0]
+                                else [])
+                for batch in rows:
+                    writer.writerows(batch)
+            writing = time.clock() - start
+            size = os.path.getsize(tmppath)
+            start = time.clock()
+            with openfile(tmppath) as stream:
+                for _ in Reader(stream, encoding='utf-8').batches():
+                    pass
+            reading = time.clock() - start
+        finally:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+        results.append((kind, level, size, writing, reading))
+    return results
+
+
 class Reader:
     """An CSV reader (for CP1252 encoding by default) that parses a
     file-like iteration of byte-strings and yields namedtuples where the
     field strings have been decoded to unicode.
 
+    Each row is decoded with one call by joining its cells with null bytes,
+    which the encoding does not use.  The :meth:`batches` method decodes
+    many rows at once, and `internfields` shares one string object between
+    repeated values of low-variety fields such as city or status codes.
+
     :ivar Row: class of the returned rows
     :type Row: namedtuple
 
@@ -49,18 +187,28 @@ class Reader:
     >>> reader = csv.Reader(infile, encoding='utf-8')
     >>> reader.next()
     Row(A=u'a', B=u'b\\xe9')
+    >>> infile = StringIO("\\n".join(["A,B","x,1","x,2","y,3"]))
+    >>> rows = list(csv.Reader(infile, internfields=['A']).batches(2))
+    >>> rows
+    [[Row(A=u'x', B=u'1'), Row(A=u'x', B=u'2')], [Row(A=u'y', B=u'3')]]
+    >>> rows[0][0].A is rows[0][1].A
+    True
     """
 
     def __init__(self, iterable, dialect=plaincsv.excel, encoding='cp1252',
-                 typename='Row', fields=None):
+                 typename='Row', fields=None, internfields=None):
         """Initialise namedtuple reader.
-        :param iterable: File or other iteration of byte-string lines.
+        :param iterable: File or other iteration of byte-string lines, or\
+        the name of a file, which is decompressed if it ends in .gz, .bz2\
+        or .xz (see :func:`openfile`).
         :param dialect: Dialect of the CSV file (see csv module)
         :param typename: Name for the created namedtuple class.
         :param fields: namedtuple of fields, or None to use CSV header line.
+        :param internfields: Names of fields whose repeated values should\
+        share one string, or True for all fields.
         """
         if isinstance(iterable, basestring):
-            iterable = open(iterable)
+            iterable = openfile(iterable)
         self.encoding = encoding
         self.reader = plaincsv.reader(iterable, dialect)
         if not fields:
@@ -70,17 +218,204 @@ class Reader:
                 raise ValueError("Empty field name")
         self.fields = tuple(fields)
         self.Row = namedtuple(typename, fields)
+        if internfields is True:
+            internfields = self.fields
+        self.internpos = [self.fields.index(f) for f in internfields or ()]
+        self.interned = {}
 
     def __iter__(self):
         return self
 
-    def next(self):
-        """Read next line"""
+    def _intern(self, values):
+        """Replace values in the interned fields with a shared copy."""
+        interned = self.interned
+        for pos in self.internpos:
+            if pos < len(values):
+                value = values[pos]
+                values[pos] = interned.setdefault(value, value)
+        return values
+
+    def _make(self, values):
+        """Construct a row from the decoded values."""
+        if self.internpos:
+            self._intern(values)
         try:
-            row = [unicode(s, self.encoding) for s in self.reader.next()]
-            return self.Row._make(row)
+            return self.Row._make(values)
         except TypeError, err:
-            raise IOError(str(err) + ": " + str(row))
+            raise IOError(str(err) + ": " + str(values))
+
+    def next(self):
+        """Read next line"""
+        cells = self.reader.next()
+        if not cells:
+            return self._make([])
+        values = unicode("\0".join(cells), self.encoding).split(u"\0")
+        return self._make(values)
+
+    def batches(self, size=1000):
+        """Read the remaining lines as lists of up to `size` rows, decoding
+        each list of rows with one call."""
+        while True:
+            batch = list(islice(self.reader, size))
+            if not batch:
+                return
+            values = unicode("\0".join(
+                "\0".join(cells) for cells in batch if cells),
+                self.encoding).split(u"\0")
+            rows, start = [], 0
+            for cells in batch:
+                if cells:
+                    rows.append(self._make(values[start:start + len(cells)]))
+                    start += len(cells)
+                else:
+                    rows.append(self._make([]))
+            yield rows
+
+
+def _split(stream, chunksize, header=True, quotechar='"',
+           blocksize=2 ** 16):
+    """Return the byte offsets at which to split a CSV stream into chunks of
+    roughly `chunksize` bytes.  Splits are only made after a newline that is
+    outside quotes, which is the case when the number of quote characters
+    before it is even (doubled quotes in a value count twice).
+
+    The first offset is the start of the first record, after the heading row
+    if `header` is true, and the last offset is the end of the stream.
+
+    >>> from StringIO import StringIO
+    >>> from dedupe import csv
+    >>> data = 'A,B\\n1,"x\\ny"\\n2,z\\n3,"w"\\n'
+    >>> offsets = csv._split(StringIO(data), 3, blocksize=4)
+    >>> [data[a:b] for a, b in zip(offsets, offsets[1:])]
+    ['1,"x\\ny"\\n', '2,z\\n', '3,"w"\\n']
+    """
+    offsets = [] if header else [0]
+    target = 0 if header else chunksize
+    position = quotes = 0
+    stream.seek(0)
+    while True:
+        block = stream.read(blocksize)
+        if not block:
+            break
+        while target < position + len(block):
+            start, found = max(target - position, 0), None
+            while found is None:
+                newline = block.find('\n', start)
+                if newline < 0:
+                    break
+                if (quotes + block.count(quotechar, 0, newline)) % 2 == 0:
+                    found = newline
+                start = newline + 1
+            if found is None:
+                break  # look for the split in the next block
+            offsets.append(position + found + 1)
+            target = position + found + 1 + chunksize
+        quotes += block.count(quotechar)
+        position += len(block)
+    if not offsets or offsets[-1] != position:
+        offsets.append(position)
+    return offsets
+
+
+def _parse_chunk(task):
+    """Parse and decode the records from a chunk of a CSV file, in a worker
+    process of :func:`load_parallel`."""
+    path, start, end, dialect, encoding = task
+    with open(path, 'rb') as stream:
+        stream.seek(start)
+        lines = stream.read(end - start).splitlines(True)
+    # Return the cells as one null-separated string and the row lengths,
+    # which is much cheaper to send back than a list of lists.
+    rows = list(plaincsv.reader(lines, dialect))
+    cells = unicode("\0".join("\0".join(row) for row in rows if row),
+                    encoding)
+    return cells, array('l', [len(row) for row in rows])
+
+
+def load_parallel(path, processes=None, chunksize=2 ** 24,
+                  dialect=plaincsv.excel, encoding='cp1252', typename='Row',
+                  fields=None, internfields=None):
+    """Load the records from a CSV file using a pool of processes, giving
+    the same rows as :class:`Reader`.
+
+    The file is split into chunks at record boundaries (allowing for
+    newlines in quoted values), each chunk is parsed and decoded in a
+    worker process, and the rows are reassembled in order.
+
+    :param path: Name of the CSV file.
+    :param processes: Number of worker processes (default: all cores).
+    :param chunksize: Approximate number of bytes in each chunk.
+    :param fields: namedtuple of fields, or None to use CSV header line.
+    :param internfields: Names of fields whose repeated values should\
+    share one string, or True for all fields (as for :class:`Reader`).
+    :rtype: [`Row`, ...]
+
+    >>> import os, tempfile
+    >>> from dedupe import csv
+    >>> path = os.path.join(tempfile.mkdtemp(), 'in.csv')
+    >>> with open(path, 'wb') as out:
+    ...     out.write('A,B\\r\\n1,"x\\r\\ny"\\r\\n2,z\\xe9\\r\\n3,w\\r\\n')
+    >>> rows = csv.load_parallel(path, processes=2, chunksize=4)
+    >>> rows == list(csv.Reader(open(path, 'rb')))
+    True
+    >>> rows[0]
+    Row(A=u'1', B=u'x\\r\\ny')
+    >>> with open(path, 'wb') as out:
+    ...     out.write('A,B\\r\\nx,1\\r\\nx,2\\r\\n')
+    >>> rows = csv.load_parallel(path, processes=2, chunksize=4,
+    ...                          internfields=['A'])
+    >>> rows[0].A is rows[1].A
+    True
+    >>> with open(path, 'wb') as out:
+    ...     out.write('A\\tB\\r\\n1\\tx,y\\r\\n2\\tz\\r\\n')
+    >>> rows = csv.load_parallel(path, processes=2, chunksize=4,
+    ...                          dialect='excel-tab')
+    >>> rows == list(csv.Reader(open(path, 'rb'), dialect='excel-tab'))
+    True
+    >>> rows[0]
+    Row(A=u'1', B=u'x,y')
+    >>> os.remove(path)
+    """
+    # The workers get the dialect as given: the object from get_dialect
+    # does not survive pickling, and would parse with the default dialect.
+    if isinstance(dialect, basestring):
+        quotechar = plaincsv.get_dialect(dialect).quotechar
+    else:
+        quotechar = dialect.quotechar
+    if compression(path):
+        raise IOError("{0}: cannot split a compressed file".format(path))
+    with open(path, 'rb') as stream:
+        offsets = _split(stream, chunksize, not fields, quotechar)
+        if not fields:
+            stream.seek(0)
+            fields = Reader(stream.read(offsets[0]).splitlines(True),
+                            dialect, encoding).fields
+    row = namedtuple(typename, fields)
+    if internfields is True:
+        internfields = fields
+    internpos = [list(fields).index(f) for f in internfields or ()]
+    interned = {}
+    tasks = [(path, start, end, dialect, encoding)
+             for start, end in zip(offsets, offsets[1:])]
+    pool = multiprocessing.Pool(processes)
+    try:
+        records = []
+        for cells, lengths in pool.imap(_parse_chunk, tasks):
+            cells, start = cells.split(u"\0"), 0
+            for length in lengths:
+                values = cells[start:start + length]
+                start += length
+                for pos in internpos:
+                    if pos < len(values):
+                        value = values[pos]
+                        values[pos] = interned.setdefault(value, value)
+                try:
+                    records.append(row._make(values))
+                except TypeError, err:
+                    raise IOError(str(err) + ": " + str(values))
+    finally:
+        pool.terminate()
+    return records
 
 
 class Writer:
@@ -90,6 +425,10 @@ class Writer:
     the output stream, by default with Windows CP1252 encoding. This class
     cannot write encodings such as utf-16 that include null bytes.
 
+    Each row is encoded with a single call on its null-joined cells, and
+    :meth:`writerows` formats rows into a buffer that is written to the
+    stream in blocks of about `bufsize` bytes.
+
     >>> from dedupe import csv
     >>> from StringIO import StringIO
     >>> out = StringIO()
@@ -97,22 +436,49 @@ class Writer:
     >>> writer.writerow([u"a",u"b\\xe9"]) # unicode é
     >>> out.getvalue() # utf-8 é
     'a,b\\xc3\\xa9\\r\\n'
+    >>> writer.writerows([[u"c", u"d"], [], [u""]])
+    >>> out.getvalue().splitlines()
+    ['a,b\\xc3\\xa9', 'c,d', '', '""']
     """
 
     def __init__(self, stream, dialect=plaincsv.excel,
-                 encoding='cp1252', **kwds):
+                 encoding='cp1252', bufsize=2 ** 16, **kwds):
         self.encoding = encoding
+        self.stream = stream
+        self.bufsize = bufsize
         self.writer = plaincsv.writer(stream, dialect=dialect, **kwds)
+        self.buffer = StringIO()
+        self.bufwriter = plaincsv.writer(self.buffer, dialect=dialect, **kwds)
+
+    def _encode(self, row):
+        """List of the encoded cells of `row`."""
+        if not isinstance(row, (list, tuple)):
+            row = list(row)
+        if not row:
+            return []
+        return u"\0".join(row).encode(
+            self.encoding, 'ignore').split("\0")
 
     def writerow(self, row):
         """Write tuple to file"""
-        self.writer.writerow([s.encode(self.encoding, errors='ignore')
-                              for s in row])
+        self.writer.writerow(self._encode(row))
 
     def writerows(self, rows):
         """Write iteration of tuples to file"""
+        buf, writerow, encode = self.buffer, self.bufwriter.writerow, \
+            self._encode
         for row in rows:
-            self.writerow(row)
+            writerow(encode(row))
+            if buf.tell() >= self.bufsize:
+                self._flush()
+        self._flush()
+
+    def _flush(self):
+        """Write the buffered rows to the stream."""
+        if self.buffer.tell():
+            self.stream.write(self.buffer.getvalue())
+            self.buffer.seek(0)
+            self.buffer.truncate()
 
 
 class Projection:
@@ -132,11 +498,16 @@ class Projection:
     Row(a=1, b=2, x=3, y=4, c='', z='')
     >>> P(b)
     Row(a=1, b='', x=4, y=2, c=3, z=5)
+    >>> Projection(['b'])(a)
+    Row(b=2)
+    >>> Projection([])(a)
+    Row()
     """
 
     def __init__(self, fields):
         self.fields = fields
         self.Row = namedtuple('Row', fields)
+        self.getters = {}  # input fields to getter of output values
 
     @staticmethod
     def unionfields(fields1, fields2):
@@ -152,6 +523,22 @@ class Projection:
     def __call__(self, row):
         """Return a row with output columns, given an input row with any
         columns.  Drops any input columns not listed in outfields."""
-        return self.Row._make(
-            getattr(row, field) if field in row._fields else ""
-                for field in self.fields)
+        try:
+            getter = self.getters[row._fields]
+        except KeyError:
+            getter = self.getters[row._fields] = self._compile(row._fields)
+        if not isinstance(row, tuple):
+            row = tuple(row)
+        return self.Row._make(getter(row + ("",)))
+
+    def _compile(self, infields):
+        """Getter of the output values from an input row with `infields`,
+        with an empty string appended for the output fields it lacks."""
+        if not self.fields:
+            return lambda row: ()
+        positions = dict((field, i) for i, field in enumerate(infields))
+        getter = itemgetter(*[positions.get(field, len(infields))
+                              for field in self.fields])
+        if len(self.fields) == 1:
+            return lambda row: (getter(row),)
+        return getter
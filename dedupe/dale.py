@@ -30,6 +30,10 @@ python-damerau-levenshtein-distance/
 
 from __future__ import division
 
+# Transpositions leave character counts unchanged, so the Levenshtein
+# bounds on similarity also hold for Damerau-Levenshtein.
+from dedupe.levenshtein import lengthbound, bound
+
 __license__ = "MIT"
 
 
@@ -0,0 +1,227 @@
+"""Stable fingerprints of records and of linkage strategies
+
+A fingerprint is a hex SHA-1 digest that stays the same from one run to the
+next as long as the records, or the definitions of the functions and objects
+making up a strategy, are unchanged.  Fingerprints key the caches and
+checkpoints that are saved to disk.
+
+Functions are fingerprinted by their byte code, constants, default arguments
+and closure variables rather than by name, so that editing a lambda changes
+its fingerprint.  The functions, classes and scalar constants that a function
+refers to as globals, or as attributes of modules it refers to, are followed
+too, so that editing a helper function also changes the fingerprint.  Classes
+are fingerprinted by name, methods and base classes.  Objects are
+fingerprinted by class name and public attributes, or by their
+`__getstate__` if they define one.
+
+Values reached in other ways, such as through a global dictionary or an
+attribute of an object, are not followed.
+"""
+
+import functools
+import hashlib
+import types
+
+
+def records(recs):
+    """Fingerprint of an iteration of records, from the values in each.
+
+    >>> from collections import namedtuple
+    >>> from dedupe import fingerprint
+    >>> R = namedtuple('R', 'A B')
+    >>> fingerprint.records([R(u'a', 1)]) == fingerprint.records([(u'a', 1)])
+    True
+    >>> fingerprint.records([(u'a', 1)]) == fingerprint.records([(u'a', 2)])
+    False
+    """
+    digest = hashlib.sha1()
+    for record in recs:
+        digest.update(repr(tuple(record)))
+        digest.update("\n")
+    return digest.hexdigest()
+
+
+def definition(obj):
+    """Fingerprint of the definition of a function, object or strategy.
+
+    >>> from dedupe import fingerprint, sim
+    >>> f1 = lambda x, y: float(x == y)
+    >>> f2 = lambda x, y: float(x == y)
+    >>> f3 = lambda x, y: float(x != y)
+    >>> fingerprint.definition(f1) == fingerprint.definition(f2)
+    True
+    >>> fingerprint.definition(f1) == fingerprint.definition(f3)
+    False
+    >>> rec1 = sim.Record(("V", sim.Field(f1, 1)))
+    >>> rec2 = sim.Record(("V", sim.Field(f1, 2)))
+    >>> fingerprint.definition(rec1) == fingerprint.definition(rec2)
+    False
+
+    Editing a global helper of a function changes its fingerprint:
+
+    >>> namespace = {}
+    >>> source = "def helper(x): return x\\ndef f(x): return helper(x)"
+    >>> exec source in namespace
+    >>> before = fingerprint.definition(namespace['f'])
+    >>> exec "def helper(x): return x.lower()" in namespace
+    >>> before == fingerprint.definition(namespace['f'])
+    False
+
+    However deeply they are nested, as in a comparator:
+
+    >>> nested = lambda f: sim.Record(("V", sim.Field(sim.Memo(
+    ...     sim.Scale(f)), 1)))
+    >>> fingerprint.definition(nested(f1)) == fingerprint.definition(
+    ...     nested(f2))
+    True
+    >>> fingerprint.definition(nested(f1)) == fingerprint.definition(
+    ...     nested(f3))
+    False
+    >>> before = fingerprint.definition(nested(namespace['f']))
+    >>> exec "def helper(x): return x.upper()" in namespace
+    >>> before == fingerprint.definition(nested(namespace['f']))
+    False
+    """
+    digest = hashlib.sha1()
+    _feed(digest, obj, set(), set())
+    return digest.hexdigest()
+
+
+class _Probe(object):
+    """Stand-in record recording the items and attributes looked up on it,
+    which reveals the field of an opaque :func:`operator.itemgetter` or
+    :func:`operator.attrgetter`."""
+
+    def __init__(self, path=()):
+        self._path = path
+
+    def __getitem__(self, key):
+        return _Probe(self._path + (('[]', key),))
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _Probe(self._path + (('.', name),))
+
+    def __call__(self, *args, **kwargs):
+        return _Probe(self._path + (('()', args, sorted(kwargs.items())),))
+
+    def __repr__(self):
+        return repr(self._path)
+
+
+def _qualname(obj):
+    """Module-qualified name of a function, class or module."""
+    return "{0}.{1}".format(getattr(obj, '__module__', None),
+                            getattr(obj, '__name__', type(obj).__name__))
+
+
+def _names(code):
+    """Sorted global and attribute names used by `code` and the code of the
+    functions nested in it."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names.update(_names(const))
+    return sorted(names)
+
+
+def _referenced(func):
+    """Sorted (name, value) of the functions, classes and scalar constants
+    that `func` refers to as globals or as attributes of global modules."""
+    names = _names(func.__code__)
+    found = {}
+    for name in names:
+        if name in func.__globals__:
+            found[name] = func.__globals__[name]
+    for module in [value for value in found.values()
+                   if isinstance(value, types.ModuleType)]:
+        for name in names:
+            if name not in found and hasattr(module, name):
+                found[name] = getattr(module, name)
+    return sorted((name, value) for name, value in found.iteritems()
+                  if _isdefinition(value) or value is None or isinstance(
+                      value, (bool, int, long, float, complex, basestring)))
+
+
+def _isdefinition(obj):
+    """Whether `obj` is a function or class defined in Python."""
+    return isinstance(obj, (types.FunctionType, types.ClassType)) or (
+        isinstance(obj, type) and obj.__module__ != '__builtin__')
+
+
+def _feed(digest, obj, path, seen):
+    """Update `digest` with the definition of `obj`.  The `path` holds ids of
+    the objects being fingerprinted, to cut off reference cycles, and `seen`
+    the ids of the functions and classes already fingerprinted in full."""
+    if id(obj) in path:
+        digest.update("<...>")
+        return
+    if obj is None or isinstance(
+        obj, (bool, int, long, float, complex, basestring)):
+        digest.update(repr(obj))
+        return
+    if isinstance(obj, (type, types.ClassType, types.ModuleType,
+                        types.BuiltinFunctionType)):
+        digest.update(_qualname(obj))
+        if not _isdefinition(obj) or id(obj) in seen:
+            return
+    elif isinstance(obj, types.FunctionType) and id(obj) in seen:
+        digest.update(_qualname(obj))
+        return
+    path.add(id(obj))
+    feed = lambda item: _feed(digest, item, path, seen)
+    digest.update("<" + type(obj).__name__ + ":")
+    if isinstance(obj, (type, types.ClassType)):
+        seen.add(id(obj))
+        feed(obj.__bases__)
+        feed(sorted((name, value) for name, value in vars(obj).iteritems()
+                    if isinstance(value, types.FunctionType)))
+    elif isinstance(obj, (tuple, list)):
+        for item in obj:
+            feed(item)
+    elif isinstance(obj, (set, frozenset)):
+        for item in sorted(obj):
+            feed(item)
+    elif isinstance(obj, types.FunctionType):
+        seen.add(id(obj))
+        feed(obj.__code__)
+        feed(obj.__defaults__)
+        for cell in obj.__closure__ or ():
+            try:
+                feed(cell.cell_contents)
+            except ValueError:  # empty cell
+                feed(None)
+        feed(_referenced(obj))
+    elif isinstance(obj, types.CodeType):
+        digest.update(obj.co_code)
+        feed(obj.co_consts)
+        feed(obj.co_names)
+    elif isinstance(obj, types.MethodType):
+        feed(obj.im_func)
+        feed(obj.im_self)
+    elif isinstance(obj, functools.partial):
+        feed(obj.func)
+        feed(obj.args)
+        feed(obj.keywords)
+    elif type(obj).__module__ == 'operator' and callable(obj):
+        try:
+            digest.update(repr(obj(_Probe())))
+        except Exception:  # pylint: disable=W0703
+            digest.update(_qualname(obj))
+    else:
+        if isinstance(obj, dict):
+            items = obj.items()
+            if type(obj) is dict:
+                items.sort()
+            feed(items)
+        if hasattr(obj, '__getstate__'):
+            feed(obj.__getstate__())
+        elif hasattr(obj, '__dict__'):
+            feed(sorted((name, value) for name, value
+                        in vars(obj).iteritems()
+                        if not name.startswith('_')))
+        elif not isinstance(obj, dict):
+            digest.update(_qualname(obj))
+    digest.update(">")
+    path.discard(id(obj))
@@ -6,11 +6,21 @@ placed at the top of the files.
 """
 
 from dedupe import csv
-from collections import defaultdict
+from dedupe.compat import replace
+from array import array
+from bisect import bisect_right
+from collections import defaultdict, deque
+from itertools import chain, izip
+import cPickle as pickle
 import logging
+import mmap
+import os
+import struct
 
 LOG = logging.getLogger('dedupe.group')
 
+_INT64 = struct.Struct("<q")
+
 
 def adjacency_list(nodepairs):
     """Construct adjacency list from edge list provided as pairs of nodes.
@@ -53,9 +63,9 @@ def components(adjlist):
     for node in adjlist.iterkeys():
         if node not in visited:
             newgroup = []  # Start the group
-            queue = [node]  # Initialise queue
+            queue = deque([node])  # Initialise queue
             while len(queue) > 0:
-                node = queue.pop(0)
+                node = queue.popleft()
                 if node not in visited:
                     newgroup.append(node)
                     visited.add(node)
@@ -66,6 +76,296 @@ def components(adjlist):
     return groups
 
 
+class UnionFind(object):
+    """Disjoint sets of nodes, merged by adding pairs of matching nodes,
+    using union by rank and path compression.  Nodes not listed in any pair
+    are absent.
+
+    :type nodepairs: [(T, T), ...]
+    :param nodepairs: Initial connections between nodes (pairs that match).
+
+    >>> from dedupe import group
+    >>> sets = group.UnionFind([(1, 2), (5, 4), (2, 3)])
+    >>> sets.find(3) == sets.find(1), sets.find(4) == sets.find(1)
+    (True, False)
+    >>> 6 in sets
+    False
+    >>> sets.groups()
+    [[1, 2, 3], [4, 5]]
+    """
+
+    def __init__(self, nodepairs=()):
+        self.parent = {}
+        self.rank = {}
+        self.union_all(nodepairs)
+
+    def __contains__(self, node):
+        return node in self.parent
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add(self, node):
+        """Add `node` as a set by itself if it is not already present."""
+        if node not in self.parent:
+            self.parent[node] = node
+            self.rank[node] = 0
+
+    def find(self, node):
+        """Return the representative node of the set containing `node`."""
+        parent = self.parent
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+        # Point the nodes along the path directly at the root
+        while parent[node] != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    def union(self, node1, node2):
+        """Merge the sets containing `node1` and `node2`, adding them if
+        necessary, and return the representative of the merged set."""
+        self.add(node1)
+        self.add(node2)
+        root1, root2 = self.find(node1), self.find(node2)
+        if root1 == root2:
+            return root1
+        if self.rank[root1] < self.rank[root2]:
+            root1, root2 = root2, root1
+        elif self.rank[root1] == self.rank[root2]:
+            self.rank[root1] += 1
+        self.parent[root2] = root1
+        return root1
+
+    def union_all(self, nodepairs):
+        """Merge the sets for each pair of matching nodes."""
+        for node1, node2 in nodepairs:
+            self.union(node1, node2)
+
+    def groups(self):
+        """Return the sets as sorted lists of nodes, in order of their
+        first (smallest) node."""
+        members = defaultdict(list)
+        for node in self.parent:
+            members[self.find(node)].append(node)
+        groups = members.values()
+        for group in groups:
+            group.sort()  # group sorted in natural order
+        groups.sort()
+        return groups
+
+
+class GroupStore(UnionFind):
+    """Groups of records that persist from one run to the next, so that new
+    match pairs extend the existing groups instead of regrouping from
+    scratch.  Each group keeps a stable number: when groups merge, the
+    merged group takes the lowest of their numbers.
+
+    :type key: function(`R`) `K`
+    :param key: Gets a stable, picklable identifier for a record, by\
+    default the tuple of its values.
+
+    :ivar changed: Numbers of the groups changed by :meth:`update`.
+
+    >>> import os, tempfile
+    >>> from dedupe import group
+    >>> path = os.path.join(tempfile.mkdtemp(), 'groups.pickle')
+    >>> store = group.GroupStore.load(path)
+    >>> sorted(store.update([(('a',), ('b',)), (('c',), ('d',))]))
+    [0, 1]
+    >>> store.save(path)
+    >>> store = group.GroupStore.load(path)
+    >>> store.update([(('e',), ('c',))])
+    set([1])
+    >>> store.groupid(('e',)), store.groupid(('a',)), store.groupid(('x',))
+    (1, 0, None)
+    >>> store.update([(('d',), ('b',))])
+    set([0])
+    >>> store.groupid(('e',))
+    0
+    >>> os.remove(path)
+    """
+
+    def __init__(self, key=tuple):
+        super(GroupStore, self).__init__()
+        self.key = key
+        self.ids = {}  # group number for each root node
+        self.nextid = 0
+        self.changed = set()
+
+    @classmethod
+    def load(cls, path, key=tuple):
+        """Load the groups saved at `path`, or start with no groups if the
+        file does not exist."""
+        store = cls(key)
+        if os.path.exists(path):
+            with open(path, 'rb') as stream:
+                store.parent, store.rank, store.ids, store.nextid = \
+                    pickle.load(stream)
+        LOG.info("name=GroupStoreLoad path=%s records=%s groups=%s",
+                 path, len(store.parent), len(store.ids))
+        return store
+
+    def save(self, path):
+        """Save the groups to `path`, replacing it only once complete."""
+        with open(path + '.tmp', 'wb') as stream:
+            pickle.dump((self.parent, self.rank, self.ids, self.nextid),
+                        stream, pickle.HIGHEST_PROTOCOL)
+        replace(path + '.tmp', path)
+
+    def union(self, node1, node2):
+        """Merge the groups of `node1` and `node2`, keeping the lowest group
+        number and marking it as changed."""
+        self.add(node1)
+        self.add(node2)
+        roots = set([self.find(node1), self.find(node2)])
+        if len(roots) == 1:
+            return roots.pop()
+        numbers = [self.ids.pop(root) for root in roots if root in self.ids]
+        root = super(GroupStore, self).union(node1, node2)
+        if numbers:
+            number = min(numbers)
+            self.changed.difference_update(numbers)
+        else:
+            number = self.nextid
+            self.nextid += 1
+        self.ids[root] = number
+        self.changed.add(number)
+        return root
+
+    def update(self, matches):
+        """Merge matching pairs of records into the groups.
+
+        :type matches: [(`R`, `R`), ...]
+        :param matches: Matching pairs of records.
+        :rtype: set([:class:`int`, ...])
+        :return: Numbers of the groups that changed.
+        """
+        self.changed = set()
+        key = self.key
+        for rec1, rec2 in matches:
+            self.union(key(rec1), key(rec2))
+        LOG.info("name=GroupStoreUpdate groups=%s changed=%s",
+                 len(self.ids), len(self.changed))
+        return self.changed
+
+    def groupid(self, record):
+        """Number of the group containing `record`, or :keyword:`None`."""
+        node = self.key(record)
+        if node not in self.parent:
+            return None
+        return self.ids.get(self.find(node))
+
+    def write_changed(self, records, ostream, projection):
+        """Write out the records in groups changed by the last
+        :meth:`update`, numbered by group, in the format of
+        :func:`write_csv`.
+
+        :type records: :keyword:`iter` [`R`, ...]
+        :param records: Iteration over records.
+        :type ostream: binary writer
+        :param ostream: where to write the CSV for the records
+        :type projection: :class:`Projection`
+        :param projection: Projection from input fields onto output fields.
+        """
+        writer = csv.Writer(ostream)
+        if projection is None:
+            projection = lambda x: x
+        else:
+            writer.writerow(["GroupID"] + projection.fields)
+        members = defaultdict(list)
+        for record in records:
+            groupid = self.groupid(record)
+            if groupid in self.changed:
+                members[groupid].append(record)
+        writer.writerows((str(groupid),) + tuple(projection(row))
+                         for groupid in sorted(members)
+                         for row in sorted(members[groupid]))
+
+
+def refine(matches, maxsize):
+    """Split groups larger than `maxsize` by cutting their weakest links.
+
+    Match pairs are merged in order of decreasing classifier score, skipping
+    any pair that would merge two groups into one of more than `maxsize`
+    records.  This is single-linkage clustering with a size budget: groups
+    within the budget are unchanged, while a chain of weak matches no longer
+    joins large groups together.  Time is dominated by sorting the pairs.
+
+    :type matches: {(T, T): :class:`float`, ...}
+    :param matches: Classifier scores of matching pairs of records.
+    :type maxsize: :class:`int`
+    :param maxsize: Largest group to allow.
+    :rtype: {(T, T): :class:`float`, ...}
+    :return: The matches that are within the refined groups.
+
+    >>> from dedupe import group
+    >>> matches = {(1, 2): 0.9, (2, 3): 0.8, (3, 4): 0.1, (4, 5): 0.9}
+    >>> group.singles_and_groups(group.refine(matches, 3), [])
+    ([], [[1, 2, 3], [4, 5]])
+    >>> group.refine(matches, 5) == matches
+    True
+    """
+    sets = UnionFind()
+    sizes = {}  # size of each group, by root
+    for (node1, node2), _ in sorted(
+        matches.iteritems(), key=lambda item: item[1], reverse=True):
+        sets.add(node1)
+        sets.add(node2)
+        root1, root2 = sets.find(node1), sets.find(node2)
+        if root1 != root2:
+            size = sizes.get(root1, 1) + sizes.get(root2, 1)
+            if size <= maxsize:
+                sizes.pop(root1, None)
+                sizes.pop(root2, None)
+                sizes[sets.union(root1, root2)] = size
+    refined = dict((pair, score) for pair, score in matches.iteritems()
+                   if sets.find(pair[0]) == sets.find(pair[1]))
+    LOG.info("name=RefineGroups maxsize=%s matches=%s cut=%s",
+             maxsize, len(matches), len(matches) - len(refined))
+    return refined
+
+
+def duplicates(records, key=tuple):
+    """Collapse records with the same `key` onto the first of them, so that
+    only one representative of each set of duplicates need be compared.
+
+    :type records: :keyword:`iter` [`R`, ...]
+    :param records: Records to collapse.
+    :type key: function(`R`) `K`
+    :param key: Hashable value identifying duplicates, such as the tuple\
+    of values for exact duplicates, or of normalised values.
+    :rtype: [`R`, ...], {`R`:[`R`, ...]}
+    :return: The representatives in order, and the copies that each\
+    representative with duplicates stands for.
+
+    >>> from dedupe import group
+    >>> records = [('Joe', '1'), ('Ann', '2'), ('joe', '1'), ('Joe', '1')]
+    >>> reps, copies = group.duplicates(records)
+    >>> reps
+    [('Joe', '1'), ('Ann', '2'), ('joe', '1')]
+    >>> copies
+    {('Joe', '1'): [('Joe', '1')]}
+    >>> reps, copies = group.duplicates(records, lambda r: r[0].lower())
+    >>> reps, copies[('Joe', '1')]
+    ([('Joe', '1'), ('Ann', '2')], [('joe', '1'), ('Joe', '1')])
+    """
+    first = {}
+    representatives = []
+    copies = defaultdict(list)
+    for record in records:
+        value = key(record)
+        try:
+            copies[first[value]].append(record)
+        except KeyError:
+            first[value] = record
+            representatives.append(record)
+    LOG.info("name=Duplicates records=%s representatives=%s",
+             len(representatives) + sum(len(c) for c in copies.itervalues()),
+             len(representatives))
+    return representatives, dict(copies)
+
+
 def singles_and_groups(matches, allrecords):
     """Given list of matched pairs, and all records, return the groups
     of similar records, and the singlets
@@ -82,9 +382,9 @@ def singles_and_groups(matches, allrecords):
     ...                          [1, 2, 3, 4, 5, 6, 7])
     ([6, 7], [[1, 2, 3], [4, 5]])
     """
-    adjlist = adjacency_list(matches)  # Map from record to neighbours
-    groups = components(adjlist)  # List of lists of records
-    singles = [rec for rec in allrecords if rec not in adjlist]
+    sets = UnionFind(matches)
+    groups = sets.groups()  # List of lists of records
+    singles = [rec for rec in allrecords if rec not in sets]
     return singles, groups
 
 
@@ -110,10 +410,286 @@ def write_csv(matches, records, ostream, projection):
     singles, groups = singles_and_groups(matches, records)
     LOG.info("name=Grouping groups=%s singles=%s", len(groups), len(singles))
     # Write groups of similar records
-    for groupid, group in enumerate(groups):
-        for row in group:
-            writer.writerow((str(groupid),) + projection(row))
+    writer.writerows((str(groupid),) + projection(row)
+                     for groupid, group in enumerate(groups) for row in group)
     # Write single records
-    for row in singles:
-        writer.writerow(("",) + projection(row))
+    writer.writerows(("",) + projection(row) for row in singles)
     return singles, groups
+
+
+def write_csv_stream(matches, sources, ostream, projection):
+    """Write out the records like :func:`write_csv`, but without
+    concatenating the record lists or holding lists of singles and groups.
+
+    The first pass over the records fills an array mapping each record's
+    position to its group number, numbering groups in order of their first
+    record, and the array is bucketed by group to write grouped rows.  The
+    second pass writes the single records as they stream past.  Rows within
+    a group are in input order.
+
+    :type matches: [(T, T), ...]
+    :param matches: List of pairs of matching records.
+    :type sources: [[T, ...], ...]
+    :param sources: Lists of records, such as input and master records.
+    :type ostream: binary writer
+    :param ostream: where to write the CSV for the records
+    :type projection: :class:`Projection`
+    :param projection: Projection from input fields onto output fields.
+    :rtype: :class:`int`, :class:`int`
+    :return: number of single rows and of groups.
+
+    >>> from StringIO import StringIO
+    >>> from dedupe import group
+    >>> out = StringIO()
+    >>> group.write_csv_stream([((u'd',), (u'b',)), ((u'c',), (u'a',))],
+    ...     [[(u'a',), (u'b',)], [(u'c',), (u'd',)]], out, None)
+    (0, 2)
+    >>> out.getvalue().split()
+    ['0,a', '0,c', '1,b', '1,d']
+    """
+    writer = csv.Writer(ostream)
+    if projection is None:
+        projection = lambda x: x
+    else:
+        writer.writerow(["GroupID"] + projection.fields)
+    sets = UnionFind(matches)
+    # Pass 1: group number of each record position, -1 for singles
+    numbers = {}  # group number of each root
+    groupids = array('l')
+    for source in sources:
+        for record in source:
+            if record in sets:
+                root = sets.find(record)
+                groupids.append(numbers.setdefault(root, len(numbers)))
+            else:
+                groupids.append(-1)
+    # Bucket the grouped record positions by group number
+    starts = array('l', [0]) * (len(numbers) + 1)
+    for groupid in groupids:
+        if groupid >= 0:
+            starts[groupid + 1] += 1
+    for groupid in xrange(len(numbers)):
+        starts[groupid + 1] += starts[groupid]
+    positions = array('l', [0]) * starts[-1]
+    for position, groupid in enumerate(groupids):
+        if groupid >= 0:
+            positions[starts[groupid]] = position
+            starts[groupid] += 1
+    # Write groups of similar records, locating each by position
+    offsets, offset = [], 0
+    for source in sources:
+        offsets.append(offset)
+        offset += len(source)
+    def grouped():
+        """Output rows of the grouped records"""
+        for position in positions:
+            sourceno = bisect_right(offsets, position) - 1
+            row = sources[sourceno][position - offsets[sourceno]]
+            yield (str(groupids[position]),) + tuple(projection(row))
+    writer.writerows(grouped())
+    # Pass 2: write single records
+    singles = groupids.count(-1)
+    writer.writerows(("",) + tuple(projection(row))
+                     for row, groupid in izip(chain(*sources), groupids)
+                     if groupid == -1)
+    LOG.info("name=Grouping groups=%s singles=%s", len(numbers), singles)
+    return singles, len(numbers)
+
+
+class _MappedArray(object):
+    """Array of 64-bit integers in a memory-mapped file, initialised to -1.
+
+    :param path: File in which to hold the array.
+    :param length: Number of integers in the array.
+    """
+
+    def __init__(self, path, length, blocksize=2 ** 20):
+        self.length = length
+        with open(path, 'wb') as stream:
+            for start in xrange(0, length * _INT64.size, blocksize):
+                stream.write("\xff" * min(
+                    blocksize, length * _INT64.size - start))
+        self.stream = open(path, 'r+b')
+        self.map = mmap.mmap(self.stream.fileno(), length * _INT64.size)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return _INT64.unpack_from(self.map, index * _INT64.size)[0]
+
+    def __setitem__(self, index, value):
+        _INT64.pack_into(self.map, index * _INT64.size, value)
+
+    def close(self):
+        """Unmap and close the file."""
+        self.map.close()
+        self.stream.close()
+
+
+def read_pairs(stream):
+    """Read pairs of integer record IDs from a two-column CSV stream, such
+    as a file of match pairs too large for memory.
+
+    >>> from StringIO import StringIO
+    >>> from dedupe import group
+    >>> list(group.read_pairs(StringIO("0,2\\n3,1\\n")))
+    [(0, 2), (3, 1)]
+    """
+    for row in csv.plaincsv.reader(stream):
+        yield int(row[0]), int(row[1])
+
+
+def disk_components(pairs, count, path):
+    """Label the connected components of records numbered 0 to `count`-1
+    given an iteration of pairs of matching record IDs.  The union-find
+    parent array is memory-mapped in the file at `path`, so that the number
+    of records and pairs is limited by disk rather than memory.
+
+    A root ID holds minus the size of its component and other IDs hold the
+    ID of their parent, with union by size and path compression.
+
+    :type pairs: :keyword:`iter` [(:class:`int`, :class:`int`), ...]
+    :param pairs: Matching pairs of record IDs.
+    :type count: :class:`int`
+    :param count: Number of records.
+    :type path: :class:`str`
+    :param path: File in which to map the parent array, beside which the\
+    group numbers are mapped in :file:`{path}.groups`.
+    :return: function(:class:`int`) :class:`int` giving the group number of\
+    a record ID, or -1 for single records, and numbering the groups in\
+    the order in which they are first looked up.  Call its `close` method\
+    when done, which removes the files.
+
+    >>> import os, tempfile
+    >>> from dedupe import group
+    >>> path = os.path.join(tempfile.mkdtemp(), 'parent.bin')
+    >>> groupof = group.disk_components([(0, 2), (3, 4), (4, 0)], 6, path)
+    >>> [groupof(i) for i in range(6)]
+    [0, -1, 0, 0, 0, -1]
+    >>> groupof.close()
+    >>> os.path.exists(path), os.path.exists(path + ".groups")
+    (False, False)
+    >>> groupof = group.disk_components([], 0, path)
+    >>> groupof.close()
+    >>> os.path.exists(path)
+    False
+    """
+    pairs = iter(pairs)
+    first = next(pairs, None)
+    if first is None:
+        # no groups, and nothing to map (which fails for no records)
+        LOG.info("name=DiskComponents records=%s pairs=0", count)
+        single = lambda node: -1
+        single.close = lambda: None
+        return single
+    pairs = chain([first], pairs)
+    parent = _MappedArray(path, count)
+
+    def find(node):
+        """Root of `node`, compressing the path to it."""
+        root = node
+        while parent[root] >= 0:
+            root = parent[root]
+        while node != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    npairs = 0
+    for node1, node2 in pairs:
+        if not (0 <= node1 < count and 0 <= node2 < count):
+            parent.close()
+            os.remove(path)
+            raise ValueError("({0}, {1}): record ID not below {2}.".format(
+                node1, node2, count))
+        npairs += 1
+        root1, root2 = find(node1), find(node2)
+        if root1 != root2:
+            if parent[root1] > parent[root2]:  # root1 is the smaller
+                root1, root2 = root2, root1
+            parent[root1] += parent[root2]
+            parent[root2] = root1
+    LOG.info("name=DiskComponents records=%s pairs=%s", count, npairs)
+    # Group number of each root of a group, mapped beside the parents
+    numbers = _MappedArray(path + ".groups", count)
+    nextnumber = [0]
+
+    def groupof(node):
+        """Group number of record `node`, or -1 for a single."""
+        root = find(node)
+        if parent[root] == -1:
+            return -1
+        if numbers[root] == -1:
+            numbers[root] = nextnumber[0]
+            nextnumber[0] += 1
+        return numbers[root]
+
+    def close():
+        """Unmap the parent and group-number arrays and remove their
+        files."""
+        parent.close()
+        numbers.close()
+        os.remove(path)
+        os.remove(path + ".groups")
+    groupof.close = close
+    return groupof
+
+
+def write_csv_ids(pairs, records, count, ostream, projection, path):
+    """Write out the records with group numbers like :func:`write_csv`,
+    but for match pairs of integer record IDs that may not fit in memory,
+    using :func:`disk_components`.  The ID of a record is its position in
+    `records`, and records are streamed out in the same order, so rows
+    of a group are not together.
+
+    :type pairs: :keyword:`iter` [(:class:`int`, :class:`int`), ...]
+    :param pairs: Matching pairs of record IDs, such as :func:`read_pairs`.
+    :type records: :keyword:`iter` [T, ...]
+    :param records: Iteration over `count` records.
+    :type count: :class:`int`
+    :param count: Number of records.
+    :type ostream: binary writer
+    :param ostream: where to write the CSV for the records
+    :type projection: :class:`Projection`
+    :param projection: Projection from input fields onto output fields.
+    :type path: :class:`str`
+    :param path: File in which to map the union-find arrays.
+    :rtype: :class:`int`, :class:`int`
+    :return: number of single rows and grouped rows.
+
+    >>> import os, tempfile
+    >>> from StringIO import StringIO
+    >>> from dedupe import group
+    >>> path = os.path.join(tempfile.mkdtemp(), 'parent.bin')
+    >>> out = StringIO()
+    >>> group.write_csv_ids([(3, 1)], [(u'a',), (u'b',), (u'c',), (u'd',)],
+    ...                     4, out, None, path)
+    (2, 2)
+    >>> out.getvalue().split()
+    [',a', '0,b', ',c', '0,d']
+    """
+    writer = csv.Writer(ostream)
+    if projection is None:
+        projection = lambda x: x
+    else:
+        writer.writerow(["GroupID"] + projection.fields)
+    if count == 0:
+        return 0, 0
+    groupof = disk_components(pairs, count, path)
+    counts = [0]  # number of singles
+    def output(recordid, row):
+        """Output row of a record"""
+        groupid = groupof(recordid)
+        if groupid == -1:
+            counts[0] += 1
+            return ("",) + tuple(projection(row))
+        return (str(groupid),) + tuple(projection(row))
+    try:
+        writer.writerows(output(recordid, row)
+                         for recordid, row in enumerate(records))
+        singles = counts[0]
+    finally:
+        groupof.close()
+    LOG.info("name=DiskGrouping singles=%s grouped=%s",
+             singles, count - singles)
+    return singles, count - singles
@@ -58,6 +58,47 @@ def similarity(a, b):
     else:
         return 1.0 - float(distance(a, b)) / max(len(a), len(b))
 
+
+def lengthbound(a, b):
+    """Upper bound on :func:`similarity` from the string lengths alone,
+    since at least the difference in length must be inserted or deleted.
+    Empty or missing values return None (no bound).
+
+    >>> from dedupe import levenshtein
+    >>> levenshtein.lengthbound("abcd", "ab")
+    0.5
+    """
+    if not a or not b:
+        return None
+    n, m = len(a), len(b)
+    return 1.0 - float(abs(n - m)) / max(n, m)
+
+
+def bound(a, b):
+    """Upper bound on :func:`similarity` from character counts.  Every
+    character occurring more often in one string than the other needs its
+    own edit, which also covers the difference in length.  Empty or missing
+    values return None (no bound).
+
+    >>> from dedupe import levenshtein
+    >>> levenshtein.bound("abcd", "dcba")
+    1.0
+    >>> levenshtein.bound("abcd", "abxy")
+    0.5
+    >>> levenshtein.similarity("abcd", "abxy")
+    0.5
+    """
+    if not a or not b:
+        return None
+    counts = {}
+    for char in a:
+        counts[char] = counts.get(char, 0) + 1
+    for char in b:
+        counts[char] = counts.get(char, 0) - 1
+    excess = sum(n for n in counts.itervalues() if n > 0)
+    deficit = -sum(n for n in counts.itervalues() if n < 0)
+    return 1.0 - float(max(excess, deficit)) / max(len(a), len(b))
+
 if __name__ == "__main__":
     import sys
     print distance(sys.argv[1], sys.argv[2])
@@ -1,17 +1,29 @@
 """Helpers for record linkage with CSV files for input and output"""
 
 import contextlib as ctx
+from itertools import chain, islice
 import logging
+from multiprocessing.pool import ThreadPool
 import os
 from os.path import join
+import time
+import dedupe.checkpoint as checkpoint
 import dedupe.csv as csv
+import dedupe.fingerprint as fingerprint
 import dedupe.group as  group
 import dedupe.sim as sim
+import dedupe.store as store
 
 LOG = logging.getLogger('dedupe.linkcsv')
 
 
-def write_indices(indices, outdir, prefix):
+def _open(path, mode='rb', level=None, bufsize=2 ** 16):
+    """Open a plain or compressed file with :func:`~csv.openfile`."""
+    return csv.openfile(path, mode, level, bufsize, opener=open)
+
+
+def write_indices(indices, outdir, prefix, suffix='.csv', level=None,
+                  bufsize=2 ** 16):
     """Write indices in CSV format.
 
     :type indices: :class:`~indexer.Indices`
@@ -20,6 +32,13 @@ def write_indices(indices, outdir, prefix):
     :param outdir: write index files to this directory.
     :type prefix: :class:`str`
     :param prefix: prepend this to each output file name.
+    :type suffix: :class:`str`
+    :param suffix: append this to each output file name, such as '.csv.gz'\
+    for compressed output.
+    :type level: :class:`int` or :keyword:`None`
+    :param level: Compression level of compressed output.
+    :type bufsize: :class:`int`
+    :param bufsize: Buffer size of compressed output.
 
     >>> from dedupe import linkcsv, csv, block, sim
     >>> makekey = lambda r: [int(r[1])]
@@ -37,15 +56,19 @@ def write_indices(indices, outdir, prefix):
     def write_index(index, stream):
         """Write a single index in CSV format to a stream"""
         writer = csv.Writer(stream)
-        for indexkey, rows in index.iteritems():
-            for row in rows:
-                writer.writerow([unicode(indexkey)]
-                                + [unicode(v) for v in row])
+        writer.writerows([unicode(indexkey)] + [unicode(v) for v in row]
+                         for indexkey, rows in index.iteritems()
+                         for row in rows)
     for indexname, index in indices.iteritems():
-        with open(join(outdir, prefix + indexname + '.csv'), 'wb') as stream:
+        with _open(join(outdir, prefix + indexname + suffix), 'wb',
+                   level, bufsize) as stream:
             write_index(index, stream)
 
 
+# Most records whose output rows write_comparisons keeps for reuse
+_MEMOSIZE = 2 ** 16
+
+
 def write_comparisons(ostream, comparator, comparisons, scores, indices1,
                       indices2=None, projection=None, origstream=None):
     """Write pairs of compared records, together with index keys and
@@ -77,38 +100,68 @@ def write_comparisons(ostream, comparator, comparisons, scores, indices1,
     indices2 = indices2 if indices2 else indices1
     # File for original records
     record_writer = None
-    # Obtain field-getter for each value comparator
-    field1 = [vcomp.field1 for vcomp in comparator.itervalues()]
-    field2 = [vcomp.field2 for vcomp in comparator.itervalues()]
-    # Use dummy classifier scores if None were provided
-    if scores is None:
-        scores = dict((k, 0) for k in comparisons.iterkeys())
-    # wrtie the similarity vectors
-    for (rec1, rec2), score in scores.iteritems():
-        weights = comparisons[(rec1, rec2)]  # look up comparison vector
-        keys1 = [idx.makekey(rec1) for idx in indices1.itervalues()]
-        keys2 = [idx.makekey(rec2) for idx in indices2.itervalues()]
-        writer.writerow([u""] +
-            [u";".join(unicode(k) for k in kl) for kl in keys1] +
-            [unicode(f(rec1)) for f in field1])
-        writer.writerow([u""] +
-            [u";".join(unicode(k) for k in kl) for kl in keys2] +
-            [unicode(f(rec2)) for f in field2])
-        # Tuple of booleans indicating whether index keys are equal
-        idxmatch = [bool(set(k1).intersection(set(k2))) if
-                     (k1 is not None and k2 is not None) else ""
-                     for k1, k2 in zip(keys1, keys2)]
-        weightrow = [score] + idxmatch + list(weights)
-        writer.writerow(str(x) for x in weightrow)
     if origstream is not None:
         record_writer = csv.Writer(origstream)
         if projection:
             record_writer.writerow(projection.fields)
         else:
             projection = lambda x: x  # no transformation
-        for (rec1, rec2), score in scores.iteritems():
-            record_writer.writerow(projection(rec1))
-            record_writer.writerow(projection(rec2))
+    # Obtain field-getter for each value comparator
+    field1 = [vcomp.field1 for vcomp in comparator.itervalues()]
+    field2 = [vcomp.field2 for vcomp in comparator.itervalues()]
+    # Use dummy classifier scores if None were provided
+    if scores is None:
+        scores = dict((k, 0) for k in comparisons.iterkeys())
+    joinkeys = lambda keys: \
+        u"" if keys is None else u";".join(unicode(k) for k in keys)
+    # Index keys and output rows of recently seen records, as records recur
+    # in pairs, cleared when full so as not to hold every output row
+    described1, described2, projected = {}, {}, {}
+
+    def describe(record, indices, fields, described):
+        """Index keys of a record and its row of keys and compared values."""
+        try:
+            return described[record]
+        except KeyError:
+            keys = [sim.getkeys(idx, record)
+                    for idx in indices.itervalues()]
+            row = ([u""] + [joinkeys(kl) for kl in keys] +
+                   [unicode(f(record)) for f in fields])
+            if len(described) >= _MEMOSIZE:
+                described.clear()
+            described[record] = keys, row
+            return keys, row
+
+    def project(record):
+        """Output row of a record."""
+        try:
+            return projected[record]
+        except KeyError:
+            if len(projected) >= _MEMOSIZE:
+                projected.clear()
+            row = projected[record] = projection(record)
+            return row
+    # Write the similarity vectors and record pairs in one pass, in batches
+    items = scores.iteritems()
+    while True:
+        batch = list(islice(items, 1000))
+        if not batch:
+            break
+        rows = []
+        for (rec1, rec2), score in batch:
+            weights = comparisons[(rec1, rec2)]  # look up comparison vector
+            keys1, row1 = describe(rec1, indices1, field1, described1)
+            keys2, row2 = describe(rec2, indices2, field2, described2)
+            # Tuple of booleans indicating whether index keys are equal
+            idxmatch = [not set(k1).isdisjoint(k2) if
+                         (k1 is not None and k2 is not None) else ""
+                         for k1, k2 in zip(keys1, keys2)]
+            weightrow = [score] + idxmatch + list(weights)
+            rows.extend((row1, row2, [str(x) for x in weightrow]))
+        writer.writerows(rows)
+        if record_writer is not None:
+            record_writer.writerows(project(rec) for pair, _ in batch
+                                    for rec in pair)
 
 
 def filelog(path):
@@ -120,19 +173,44 @@ def filelog(path):
     logging.getLogger().addHandler(filehandler)
 
 
-def writecsv(path, rows, header=None):
-    """Write the `header` and `rows` to csv file at `path`"""
-    with open(path, 'wb') as out:
+def writecsv(path, rows, header=None, level=None, bufsize=2 ** 16):
+    """Write the `header` and `rows` to csv file at `path`, compressed with
+    `level` and a buffer of `bufsize` bytes if the name ends in .gz, .bz2 or
+    .xz."""
+    with _open(path, 'wb', level, bufsize) as out:
         writer = csv.Writer(out)
         if header:
             writer.writerow(header)
         writer.writerows(rows)
 
 
-def loadcsv(path):
-    """Load records from csv at `path` as a list of :class:`namedtuple`"""
-    with open(path, 'rb') as istream:
-        return list(csv.Reader(istream))
+def loadcsv(path, internfields=None, processes=1, snapshot=None,
+            bufsize=2 ** 16):
+    """Load records from csv at `path` as a list of :class:`namedtuple`,
+    optionally interning the values of `internfields`.  With `processes`
+    other than 1, load in parallel with that many processes (:keyword:`None`
+    for all cores) using :func:`~csv.load_parallel`.
+
+    For inputs larger than memory, give the path of a `snapshot` file to
+    return a memory-mapped :class:`~store.Snapshot` of lazy records instead.
+    The snapshot is converted from the CSV file when it is missing or older.
+
+    Files ending in .gz, .bz2 or .xz are decompressed as they are read
+    through a buffer of `bufsize` bytes, always in a single process since
+    they cannot be split.
+    """
+    if snapshot is not None:
+        if not os.path.exists(snapshot) or \
+           os.path.getmtime(snapshot) < os.path.getmtime(path):
+            store.convert(path, snapshot)
+        return store.Snapshot(snapshot)
+    if processes != 1 and not csv.compression(path):
+        return csv.load_parallel(path, processes, internfields=internfields)
+    records = []
+    with _open(path, 'rb', bufsize=bufsize) as istream:
+        for batch in csv.Reader(istream, internfields=internfields).batches():
+            records.extend(batch)
+    return records
 
 
 class LinkCSV(object):
@@ -161,15 +239,69 @@ class LinkCSV(object):
     :param master: master records to which `records` should be linked.
     :type logname: :class:`str` or :keyword:`None`
     :param logname: Name of log file to write to in output directory.
+    :type groupstore: :class:`str` or :keyword:`None`
+    :param groupstore: Path of a :class:`~group.GroupStore` that is loaded,\
+    extended with the matches, and saved again.
+    :type groupkey: function(`R`) `K`
+    :param groupkey: Stable identifier of records in the `groupstore`.
+    :type maxgroup: :class:`int` or :keyword:`None`
+    :param maxgroup: Split groups larger than this by cutting the\
+    lowest-scoring matches (see :func:`~group.refine`).
+    :type compress: :class:`str` or :keyword:`None`
+    :param compress: Compress the output files with 'gz', 'bz2' or 'xz',\
+    adding that extension to their names.
+    :type level: :class:`int` or :keyword:`None`
+    :param level: Compression level of the output files.
+    :type bufsize: :class:`int`
+    :param bufsize: Buffer size of the compressed output files.
+    :type keepkeys: :class:`bool`
+    :param keepkeys: Keep the index keys of the records for writing the\
+    comparisons, rather than computing them again (costs memory, default off).
+    :type resume: :class:`bool`
+    :param resume: Save checkpoints of the indices and comparisons in the\
+    output directory, and load those of an earlier run instead when the\
+    records, index strategy and comparator are unchanged, so that only the\
+    classifier is run again.
+    :type masterindex: :class:`str` or :keyword:`None`
+    :param masterindex: Path prefix of saved master indices (see\
+    :func:`~store.save_indices`), which are memory-mapped instead of\
+    indexing the `master` records, or built and saved if missing, damaged\
+    or made with another strategy or other master records.  A `master`\
+    :class:`~store.Snapshot` is checked by its file, and a list of master\
+    records by the values of all of them.
+    :type budget: :class:`~budget.Budget` or :keyword:`None`
+    :param budget: Limits on the estimated pairs, time and memory for the\
+    comparisons, checked after indexing so that an over-budget linkage\
+    fails (or warns) before the comparisons are run.
+    :type collapse: :class:`bool` or function(`R`) `K`
+    :param collapse: Link only one representative of each set of duplicate\
+    records, which are exact duplicates if this is :keyword:`True`, or\
+    records with the same value of this function, such as a tuple of\
+    normalised fields (see :func:`~group.duplicates`).  The duplicates are\
+    grouped with their representative.
 
     :type indeces1, indeces2: :class:`~sim.Indeces`
     :ivar indeces1, indeces2: Indexed input and master records.
     :type matches, nonmatches: {(`R`, `R`)::class:`float`}
     :ivar matches, nonmatches: classifier scores of matched/nonmatched pairs.
+    :type groupstore: :class:`~group.GroupStore` or :keyword:`None`
+    :ivar groupstore: Persistent groups updated with the matches.
+    :type groupmatches: {(`R`, `R`)::class:`float`}
+    :ivar groupmatches: matches that are used for grouping records, with\
+    score 1.0 for pairs of representative and duplicate.
+    :type linked1, linked2: [`R`, ...]
+    :ivar linked1, linked2: Input and master records that were linked,\
+    which are the representatives when collapsing duplicates.
+    :type copies1, copies2: {`R`:[`R`, ...]}
+    :ivar copies1, copies2: Duplicates of each input and master\
+    representative that has any.
     """
 
     def __init__(self, outdir, indexstrategy, comparator, classifier, records,
-                 master=None, logname='linkage.log'):
+                 master=None, logname='linkage.log', groupstore=None,
+                 groupkey=tuple, maxgroup=None, compress=None, level=None,
+                 keepkeys=False, resume=False, masterindex=None, budget=None,
+                 collapse=None, bufsize=2 ** 16):
         """
         :rtype: {(R, R):float}, {(R, ):float}
         :return: classifier scores for match pairs and non-match pairs
@@ -180,24 +312,123 @@ class LinkCSV(object):
         self.records1 = records
         self.records2 = master if master else []
         self.outdir = outdir
+        self.compress = compress
+        self.level = level
+        self.bufsize = bufsize
+        self._projection = None
         if self.outdir is not None and logname is not None:
             filelog(self.opath(logname))
+        # Collapse duplicates onto representatives for linking
+        self.copies1, self.copies2 = {}, {}
+        self.linked1, self.linked2 = self.records1, self.records2
+        if collapse:
+            key = tuple if collapse is True else collapse
+            self.linked1, self.copies1 = group.duplicates(self.records1, key)
+            if self.records2:
+                self.linked2, self.copies2 = group.duplicates(
+                    self.records2, key)
         # Index the records and print the stats
-        self.indices1 = sim.Indices(self.indexstrategy, self.records1)
-        self.indices2 = None
-        if self.records2:
-            self.indices2 = sim.Indices(self.indexstrategy, self.records2)
+        strategykey = fingerprint.definition(indexstrategy) if resume else ""
+        self.indices1, key1 = self.index_stage(
+            "input-indices.ckpt", self.linked1, strategykey, keepkeys,
+            resume)
+        self.indices2, key2 = None, ""
+        if self.linked2 and masterindex is not None:
+            masterkey = store.records_key(self.linked2)
+            self.indices2 = self.master_indices(masterindex, masterkey)
+            if resume:
+                key2 = checkpoint.key(masterkey, strategykey)
+        elif self.linked2:
+            self.indices2, key2 = self.index_stage(
+                "master-indices.ckpt", self.linked2, strategykey, keepkeys,
+                resume)
         # Compute the similarity vectors
         self.indices1.log_comparisons(self.indices2)
-        self.comparisons = self.indices1.compare(
-            self.comparator, self.indices2)
+        self.comparisons = None
+        if resume:
+            path = self.opath("comparisons.ckpt")
+            cachekey = checkpoint.key(
+                key1, key2, fingerprint.definition(comparator))
+            self.comparisons = checkpoint.load_comparisons(
+                path, cachekey, comparator, self.linked1, self.linked2)
+        if self.comparisons is None:
+            if budget is not None:
+                budget.enforce(self.linked1, self.indices1, comparator,
+                               self.indices2, self.linked2)
+            self.comparisons = self.indices1.compare(
+                self.comparator, self.indices2)
+            if isinstance(self.comparator, sim.Record):
+                self.comparator.log_stats()
+            if resume:
+                checkpoint.save_comparisons(path, cachekey, self.comparisons,
+                                            self.linked1, self.linked2)
         # Classify the similarity vectors
         self.matches, self.nonmatches = classifier(self.comparisons)
+        # Optionally split oversized groups
+        self.groupmatches = self.matches
+        if maxgroup is not None:
+            self.groupmatches = group.refine(self.matches, maxgroup)
+        # Group the duplicates with their representatives
+        if self.copies1 or self.copies2:
+            self.groupmatches = dict(self.groupmatches)
+            for copies in self.copies1, self.copies2:
+                for record, duplicates in copies.iteritems():
+                    for copy in duplicates:
+                        self.groupmatches[(record, copy)] = 1.0
+        # Extend the persistent groups with the matches
+        self.groupstore = None
+        if groupstore is not None:
+            self.groupstore = group.GroupStore.load(groupstore, groupkey)
+            self.groupstore.update(self.groupmatches)
+            self.groupstore.save(groupstore)
+
+    def index_stage(self, name, records, strategykey, keepkeys, resume):
+        """Return the indices of the `records`, loaded from checkpoint file
+        `name` when resuming, and the fingerprint of the records and index
+        strategy (empty when not resuming)."""
+        if not resume:
+            return sim.Indices(self.indexstrategy, records, keepkeys), ""
+        path = self.opath(name)
+        cachekey = checkpoint.key(fingerprint.records(records), strategykey)
+        indices = checkpoint.load_indices(
+            path, cachekey, self.indexstrategy, records, keepkeys)
+        if indices is None:
+            indices = sim.Indices(self.indexstrategy, records, keepkeys)
+            checkpoint.save_indices(path, cachekey, indices, records)
+        return indices, cachekey
+
+    def master_indices(self, prefix, masterkey):
+        """Return the master indices saved at `prefix`, or build them and
+        save them there, if they are missing or damaged or do not match the
+        fingerprint `masterkey` of the master records (see
+        :func:`~store.records_key`)."""
+        strategykeys = [fingerprint.definition(strategy)
+                        for strategy in self.indexstrategy]
+        try:
+            return store.load_indices(prefix, self.indexstrategy,
+                                      self.linked2, strategykeys, masterkey)
+        except IOError, err:
+            LOG.info("name=BuildMasterIndex reason=%s", err)
+        indices = sim.Indices(self.indexstrategy, self.linked2)
+        store.save_indices(prefix, indices, self.linked2, strategykeys,
+                           masterkey)
+        return indices
 
     def opath(self, name):
         """Path for a file `name` in the :attr:`odir`."""
         return os.path.join(self.outdir, name)
 
+    def cpath(self, name):
+        """Path for an output file `name` in the :attr:`odir`, with the
+        extension of the :attr:`compress` format if there is one."""
+        if self.compress:
+            name += "." + self.compress
+        return self.opath(name)
+
+    def ofile(self, name):
+        """Open output file `name` for writing (see :meth:`cpath`)."""
+        return _open(self.cpath(name), 'wb', self.level, self.bufsize)
+
     @property
     def fields1(self):
         """Field names on input records."""
@@ -216,57 +447,119 @@ class LinkCSV(object):
 
     @property
     def projection(self):
-        """Convert input/master records into output records."""
-        if self.fields1:
-            return csv.Projection.unionfields(self.fields2, self.fields1)
-        else:
+        """Convert input/master records into output records.  The same
+        :class:`~csv.Projection` is returned each time, so that its compiled
+        getters are reused."""
+        if not self.fields1:
             return None
+        if self._projection is None:
+            self._projection = csv.Projection.unionfields(
+                self.fields2, self.fields1)
+        return self._projection
 
-    def write_all(self):
+    def write_all(self, threads=None):
         """Call all of the other `write_*` methods, for full analysis.
 
+        :type threads: :class:`int` or :keyword:`None`
+        :param threads: Write the files concurrently with this many threads,\
+        which overlaps disk writes and compression with formatting.
+
         .. warning::
            The total output may be as much as 10x larger than the input file.
         """
-        self.write_records()
-        self.write_indeces()
-        if self.records2:
-            self.write_input_splits()
-        self.write_match_pairs()
-        self.write_nonmatch_pairs()
-        self.write_groups()
+        # with a master, the input records and their splits share a pass
+        tasks = [self.write_records_and_splits if self.records2
+                 else self.write_records, self.write_indeces]
+        tasks.extend([self.write_match_pairs, self.write_nonmatch_pairs,
+                      self.write_groups])
+        if self.groupstore is not None:
+            tasks.append(self.write_changed_groups)
+        start = time.time()
+        if threads is None or threads <= 1:
+            for task in tasks:
+                task()
+        else:
+            pool = ThreadPool(threads)
+            try:
+                pool.map(lambda task: task(), tasks)
+            finally:
+                pool.close()
+        LOG.info("name=WriteAll files=%s threads=%s seconds=%.2f",
+                 len(tasks), threads, time.time() - start)
 
     def write_records(
         self, inputrecs="input-records.csv", masterrecs="input-master.csv"):
         """Write the input and master records CSV files."""
-        writecsv(self.opath(inputrecs), self.records1, self.fields1)
+        writecsv(self.cpath(inputrecs), self.records1, self.fields1,
+                 self.level, self.bufsize)
         if self.indices2:
-            writecsv(self.opath(masterrecs), self.records2, self.fields2)
+            writecsv(self.cpath(masterrecs), self.records2, self.fields2,
+                     self.level, self.bufsize)
 
     def write_indeces(self, inputpre="InputIdx-", masterpre="MasterIdx-"):
         """Write contents of each :class:`~indexer.Index` to files starting
         with these prefixes."""
-        write_indices(self.indices1, self.outdir, inputpre)
+        suffix = ".csv." + self.compress if self.compress else ".csv"
+        write_indices(self.indices1, self.outdir, inputpre, suffix,
+                      self.level, self.bufsize)
         if self.indices2:
-            write_indices(self.indices2, self.outdir, masterpre)
+            write_indices(self.indices2, self.outdir, masterpre, suffix,
+                          self.level, self.bufsize)
+
+    def matchset(self):
+        """Set of the input records that matched master records, with their
+        duplicates."""
+        matchset = set(a for a, b in self.matches)
+        for record in list(matchset):
+            matchset.update(self.copies1.get(record, ()))
+        return matchset
 
     def write_input_splits(
         self, matches='input-matchrows.csv', singles='input-singlerows.csv'):
         """Write input records that matched and did not match master (requires
         that `master` was specified)."""
-        matchset = set(a for a, b in self.matches)
-        matchrows = [r for r in self.records1 if r in matchset]
-        singlerows = [r for r in self.records1 if r not in matchset]
-        writecsv(self.opath(matches), matchrows, self.fields1)
-        writecsv(self.opath(singles), singlerows, self.fields1)
+        matchset = self.matchset()
+        matchrows, singlerows = [], []
+        for record in self.records1:
+            if record in matchset:
+                matchrows.append(record)
+            else:
+                singlerows.append(record)
+        writecsv(self.cpath(matches), matchrows, self.fields1, self.level,
+                 self.bufsize)
+        writecsv(self.cpath(singles), singlerows, self.fields1, self.level,
+                 self.bufsize)
+
+    def write_records_and_splits(
+        self, inputrecs="input-records.csv", masterrecs="input-master.csv",
+        matches='input-matchrows.csv', singles='input-singlerows.csv'):
+        """Write the files of :meth:`write_records` and
+        :meth:`write_input_splits` in one pass over the input records."""
+        matchset = self.matchset()
+        with ctx.nested(self.ofile(inputrecs), self.ofile(matches),
+                        self.ofile(singles)) as streams:
+            allw, matchw, singlew = [csv.Writer(s) for s in streams]
+            if self.fields1:
+                for writer in allw, matchw, singlew:
+                    writer.writerow(self.fields1)
+            records = iter(self.records1)
+            while True:
+                batch = list(islice(records, 1000))
+                if not batch:
+                    break
+                allw.writerows(batch)
+                matchw.writerows(r for r in batch if r in matchset)
+                singlew.writerows(r for r in batch if r not in matchset)
+        if self.indices2:
+            writecsv(self.cpath(masterrecs), self.records2, self.fields2,
+                     self.level, self.bufsize)
 
     def write_match_pairs(
         self, comps="match-comparisons.csv", pairs="match-pairs.csv"):
         """For matched pairs, write the record comparisons and original record
         pairs."""
         _ = self
-        with ctx.nested(open(_.opath(comps), 'wb'),
-                        open(_.opath(pairs), 'wb')) as (o_comps, o_pairs):
+        with ctx.nested(_.ofile(comps), _.ofile(pairs)) as (o_comps, o_pairs):
             write_comparisons(o_comps, _.comparator, _.comparisons, _.matches,
                               _.indices1, _.indices2, self.projection, o_pairs)
 
@@ -275,8 +568,7 @@ class LinkCSV(object):
         """For non-matched pairs, write the record comparisons and original
         record pairs."""
         _ = self
-        with ctx.nested(open(_.opath(comps), 'wb'),
-                        open(_.opath(pairs), 'wb')) as (o_comps, o_pairs):
+        with ctx.nested(_.ofile(comps), _.ofile(pairs)) as (o_comps, o_pairs):
             write_comparisons(
                 o_comps, _.comparator, _.comparisons, _.nonmatches,
                 _.indices1, _.indices2, self.projection, o_pairs)
@@ -284,7 +576,15 @@ class LinkCSV(object):
     def write_groups(self, groups="groups.csv"):
         """Write out all records, with numbered groups of mutually linked
         records first."""
-        with open(self.opath(groups), 'wb') as ofile:
-            group.write_csv(
-                self.matches, self.records1 + self.records2,
+        with self.ofile(groups) as ofile:
+            group.write_csv_stream(
+                self.groupmatches, [self.records1, self.records2],
                 ofile, self.projection)
+
+    def write_changed_groups(self, groups="changed-groups.csv"):
+        """Write out the records in persistent groups that changed in this
+        run, numbered by their stable group number (requires that
+        `groupstore` was specified)."""
+        with self.ofile(groups) as ofile:
+            self.groupstore.write_changed(
+                chain(self.records1, self.records2), ofile, self.projection)
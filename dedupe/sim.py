@@ -1,14 +1,22 @@
 """Compare values, fields, and records for similarity"""
 
 import collections
+import inspect
 import logging
 
+from dedupe import dale as _dale, levenshtein as _levenshtein
 from dedupe.dale import similarity as dale
 from dedupe.levenshtein import similarity as levenshtein
 from dedupe.compat import OrderedDict as _OrderedDict
 
 LOG = logging.getLogger('dedupe.sim')
 
+# Cheap upper bounds on built-in similarity functions, used by Scale
+_BOUNDS = {
+    dale: (_dale.lengthbound, _dale.bound),
+    levenshtein: (_levenshtein.lengthbound, _levenshtein.bound),
+}
+
 
 class Convert(object):
     """Gets a single-valued field and converts it to a comparable value.
@@ -65,6 +73,14 @@ class Scale(object):
     :param missing: Return `missing` when `similarity` returns `None`.
     :param test: Callable of record to test bad values.  If `a` and `b` pass\
     the test then return `similarity(a, b)`, otherwise return `missing`.
+    :param bounds: Callables of `a` and `b` returning an upper bound on\
+    `similarity(a, b)`, or `None` for no bound.  When a bound is at most\
+    `low` the result is 0.0 without calling `similarity`.  By default, the\
+    :mod:`~dedupe.levenshtein` and :mod:`~dedupe.dale` similarities use\
+    their length and character-count bounds when `low` is above 0.0.
+
+    :ivar calls: Number of calls that passed the `test`.
+    :ivar pruned: Number of those calls that a bound decided.
 
     >>> from dedupe import sim
     >>> simfunc = lambda a, b: 2**-abs(a-b)
@@ -83,10 +99,15 @@ class Scale(object):
     >>> isnum = lambda x: isinstance(x, int) or isinstance(x, float)
     >>> print sim.Scale(simfunc, test=isnum)("blah", 2)
     None
+    >>> lev = sim.Scale(sim.levenshtein, low=0.5)
+    >>> lev("abcdef", "ab"), lev("abcd", "abce"), lev("abc", "xyz")
+    (0.0, 0.5, 0.0)
+    >>> lev.calls, lev.pruned
+    (3, 2)
     """
 
-    def __init__(self, similarity,
-                 low=0.0, high=1.0, rmax=1.0, missing=None, test=None):
+    def __init__(self, similarity, low=0.0, high=1.0, rmax=1.0,
+                 missing=None, test=None, bounds=None):
         if not (0.0 <= low < high):
             raise ValueError("low: {0}, high: {1}".format(low, high))
         self.similarity = similarity
@@ -95,6 +116,21 @@ class Scale(object):
         self.rmax = rmax
         self.missing = missing
         self.test = test
+        if bounds is None:
+            bounds = _BOUNDS.get(similarity, ()) if low > 0.0 else ()
+        self.bounds = tuple(bounds)
+        self.calls = 0
+        self.pruned = 0
+
+    def __getstate__(self):
+        """State without the call counters."""
+        state = self.__dict__.copy()
+        del state['calls'], state['pruned']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.calls = self.pruned = 0
 
     def scale(self, value):
         """Scale a value from (low, high) range to (0, 1) range."""
@@ -108,11 +144,118 @@ class Scale(object):
         """Similarity of a and b, scaled to (0, 1) range."""
         if self.test and not (self.test(a) and self.test(b)):
             return self.missing
+        self.calls += 1
+        for bound in self.bounds:
+            upper = bound(a, b)
+            if upper is not None and upper <= self.low:
+                self.pruned += 1
+                return 0.0
         v = self.similarity(a, b)
         if v is None:
             return self.missing
         return self.scale(v)
 
+    def log_pruned(self, name):
+        """Log how many calls the bounds pruned, prefixing with `name`."""
+        LOG.info("name=ScalePruned field=%s calls=%s pruned=%s",
+                 name, self.calls, self.pruned)
+
+
+class Memo(object):
+    """Remember the similarity of pairs of values, for fields such as city
+    or first name whose values repeat across many records.
+
+    Each value is dictionary-encoded to a small integer code, and the
+    results of `compare` are kept in a table keyed by the pair of codes.
+    The same :class:`Memo` serves every block and index that the comparator
+    is used on.  Values that cannot be hashed are compared directly.
+
+    :type compare: callable(`V`, `V`) :class:`float`
+    :param compare: Similarity of a pair of values, such as a :class:`Scale`.
+    :type maxsize: :class:`int`
+    :param maxsize: Most value codes and remembered results.  The table is\
+    cleared when full, and values beyond `maxsize` distinct ones are\
+    compared without being remembered.
+    :type symmetric: :class:`bool`
+    :param symmetric: Whether `compare(a, b) == compare(b, a)`, so that\
+    both orders share a result.
+
+    :ivar calls: Number of calls.
+    :ivar hits: Number of calls answered from the table.
+
+    >>> from dedupe import sim
+    >>> lev = sim.Scale(sim.levenshtein)
+    >>> memo = sim.Memo(lev, symmetric=True)
+    >>> memo("Smith", "Smyth"), memo("Smyth", "Smith"), memo("Smith", "Smyth")
+    (0.8, 0.8, 0.8)
+    >>> memo.calls, memo.hits, lev.calls, len(memo.codes)
+    (3, 2, 1, 2)
+    >>> memo(["a"], ["a"]), memo.calls, memo.hits
+    (1.0, 4, 2)
+    >>> from dedupe import fingerprint
+    >>> fingerprint.definition(memo) == fingerprint.definition(
+    ...     sim.Memo(sim.Scale(sim.levenshtein), symmetric=True))
+    True
+    """
+
+    def __init__(self, compare, maxsize=2 ** 20, symmetric=False):
+        if not 0 < maxsize < 2 ** 32:
+            raise ValueError("maxsize: {0}".format(maxsize))
+        self.compare = compare
+        self.maxsize = maxsize
+        self.symmetric = symmetric
+        self.codes = {}
+        self.table = {}
+        self.calls = 0
+        self.hits = 0
+
+    def __getstate__(self):
+        """State without the codes, remembered results and counters."""
+        state = self.__dict__.copy()
+        del state['codes'], state['table'], state['calls'], state['hits']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.codes, self.table = {}, {}
+        self.calls = self.hits = 0
+
+    def _code(self, value):
+        """Code of `value`, or :keyword:`None` once the codes are full."""
+        codes = self.codes
+        code = codes.get(value)
+        if code is None and len(codes) < self.maxsize:
+            code = codes[value] = len(codes)
+        return code
+
+    def __call__(self, a, b):
+        """Similarity of `a` and `b`, from the table if already known."""
+        self.calls += 1
+        try:
+            code1, code2 = self._code(a), self._code(b)
+        except TypeError:  # unhashable values
+            return self.compare(a, b)
+        if code1 is None or code2 is None:
+            return self.compare(a, b)
+        if self.symmetric and code1 > code2:
+            code1, code2 = code2, code1
+        key = code1 << 32 | code2
+        table = self.table
+        if key in table:
+            self.hits += 1
+            return table[key]
+        if len(table) >= self.maxsize:
+            table.clear()
+        result = table[key] = self.compare(a, b)
+        return result
+
+    def log_stats(self, name):
+        """Log the hit rate of the table, prefixing with `name`."""
+        LOG.info("name=MemoStats field=%s calls=%s hits=%s hitrate=%.3f "
+                 "codes=%s", name, self.calls, self.hits,
+                 float(self.hits) / self.calls if self.calls else 0.0,
+                 len(self.codes))
+
 
 class Field(object):
     """Computes the similarity of a pair of records on a specific field.
@@ -161,7 +304,66 @@ class Field(object):
             return None
 
 
-class Average(Field):
+class _MultiField(Field):
+    """Base of the similarities on a multi-valued field, which compare the
+    sets of encoded values of a pair of records.
+
+    :type identical: :class:`float` or :keyword:`None`
+    :param identical: Similarity of equal values, which no pair of values\
+    exceeds, such as 1.0.  Values shared by both records then score\
+    `identical` without calling `compare`, and the search for the best\
+    match of a value stops on reaching it.  By default (:keyword:`None`)\
+    every pair of values is compared, which is needed when `compare` may\
+    score equal values lower, as :class:`Scale` does with a `test`.
+    :type cache: :class:`int`
+    :param cache: Most records whose encoded values are kept for later\
+    comparisons, clearing the cache when full (default 0, no cache).
+    """
+
+    def __init__(self, compare, field1, encode1=None, field2=None,
+                 encode2=None, identical=None, cache=0):
+        Field.__init__(self, compare, field1, encode1, field2, encode2)
+        self.identical = identical
+        self.cache = cache
+        self._cache1, self._cache2 = {}, {}
+
+    def _encoded(self, record, field, encode, cache):
+        """Set of encoded values of `record`, from the `cache` if known."""
+        if not self.cache:
+            return frozenset(encode(v) for v in field(record))
+        try:
+            return cache[record]
+        except TypeError:  # unhashable record
+            return frozenset(encode(v) for v in field(record))
+        except KeyError:
+            if len(cache) >= self.cache:
+                cache.clear()
+            values = cache[record] = frozenset(
+                encode(v) for v in field(record))
+            return values
+
+    def _sets(self, record1, record2):
+        """Sets of encoded values of `record1` and `record2`."""
+        return (self._encoded(record1, self.field1, self.encode1,
+                              self._cache1),
+                self._encoded(record2, self.field2, self.encode2,
+                              self._cache2))
+
+    def _best(self, v1, values):
+        """Greatest similarity of `v1` to any of `values`."""
+        compare = self.compare
+        top = float('inf') if self.identical is None else self.identical
+        best = 0.0
+        for v2 in values:
+            comp = compare(v1, v2)
+            if comp > best:
+                best = comp
+                if best >= top:
+                    break
+        return best
+
+
+class Average(_MultiField):
     """Computes the average similarity of a pair of records on
     a multi-valued field.
 
@@ -182,6 +384,12 @@ class Average(Field):
     :param encode1: Encodes each field1 value for comparison.
     :type encode2: function(`T2`) `V`
     :param encode2: Encodes each field2 value for comparison (`encode1`).
+    :type identical: :class:`float` or :keyword:`None`
+    :param identical: Similarity of equal values, which no pair exceeds, so\
+    that shared values skip `compare` (default :keyword:`None`, compare\
+    all pairs).
+    :type cache: :class:`int`
+    :param cache: Most records to cache encoded values for (default 0).
 
     :rtype: callable(`R1`, `R2`) float
     :return: Computer of average similarity of records `R1` and `R2`\
@@ -199,28 +407,41 @@ class Average(Field):
     >>> sim.Average(similarity, field, float)(
     ...             ('A', '0;1;2'), ('B', '0;1;2;3;4'))
     1.0
+
+    With `identical` the shared values are not compared with `compare`, and
+    with a `cache` each record is encoded once:
+
+    >>> calls, encoded = [], []
+    >>> counted = lambda x, y: calls.append((x, y)) or similarity(x, y)
+    >>> encode = lambda v: encoded.append(v) or float(v)
+    >>> average = sim.Average(counted, field, encode, identical=1.0,
+    ...                       cache=100)
+    >>> round(average(('A', '0;1;2'), ('B', '0;1;5')), 3), len(calls)
+    (0.833, 3)
+    >>> round(average(('A', '0;1;2'), ('B', '0;1;5')), 3), len(encoded)
+    (0.833, 6)
     """
 
     def __call__(self, record1, record2):
         """Return the average similarity of `record1` and `record2` on
         this multi-valued field"""
-        f1 = set(self.encode1(v1) for v1 in self.field1(record1))
-        f2 = set(self.encode2(v2) for v2 in self.field2(record2))
+        f1, f2 = self._sets(record1, record2)
         f1, f2 = sorted([f1, f2], key=len)  # short set, long set
         # Missing value check
         if len(f1) == 0 or len(f2) == 0:
             return self.compare(None, None)
-        total = 0.0
-        for v1 in f1:
-            best = 0.0
-            for v2 in f2:
-                comp = self.compare(v1, v2)
-                best = max(best, comp)
-            total += best  # score of most similar item in the long set
+        if self.identical is None:
+            rest, total = f1, 0.0
+        else:
+            # each shared value is its own most similar item
+            shared = f1 & f2
+            rest, total = f1 - shared, self.identical * len(shared)
+        for v1 in rest:
+            total += self._best(v1, f2)  # most similar item in long set
         return total / len(f1)
 
 
-class Maximum(Field):
+class Maximum(_MultiField):
     """Computes the maximum similarity of a pair of records on a
     multi-valued field.
 
@@ -236,6 +457,12 @@ class Maximum(Field):
     :type encode2: function(`T2`) `V`
     :param encode2: Encodes each field2 value for comparison\
     (default: `encode1`).
+    :type identical: :class:`float` or :keyword:`None`
+    :param identical: Similarity of equal values, which no pair exceeds, so\
+    that shared values skip `compare` (default :keyword:`None`, compare\
+    all pairs).
+    :type cache: :class:`int`
+    :param cache: Most records to cache encoded values for (default 0).
 
     >>> # define an exponential 'similarity of numbers' measure
     >>> similarity = lambda x, y: 2.0**(-abs(x-y))
@@ -246,24 +473,95 @@ class Maximum(Field):
     >>> field = lambda r: set(r[1].split(';'))
     >>> sim.Maximum(similarity, field, float)(('A', '0;1;2'), ('B', '3;4;5'))
     0.5
+    >>> sim.Maximum(None, field, float, identical=1.0)(
+    ...     ('A', '0;1;2'), ('B', '2;3'))
+    1.0
+
+    Without `identical` shared values are compared like any other, so a
+    shared empty value is not a match:
+
+    >>> lev = sim.Scale(sim.levenshtein)
+    >>> field = lambda r: r[1].split(';')
+    >>> sim.Maximum(lev, field)(('A', ';abc'), ('B', ';xyz'))
+    0.0
     """
 
     def __call__(self, record1, record2):
         """Return the maximum similarity of `record1` and `record2` on
         this multi-valued field."""
-        f1 = set(self.encode1(v1) for v1 in self.field1(record1))
-        f2 = set(self.encode2(v2) for v2 in self.field2(record2))
+        f1, f2 = self._sets(record1, record2)
         # Missing value check
         if len(f1) == 0 or len(f2) == 0:
             return self.compare(None, None)
+        identical = self.identical
+        if identical is not None and not f1.isdisjoint(f2):
+            return identical
         best = 0.0
         for v1 in f1:
-            for v2 in f2:
-                comp = self.compare(v1, v2)
-                best = max(best, comp)
+            best = max(best, self._best(v1, f2))
+            if identical is not None and best >= identical:
+                break
         return best
 
 
+class Overlap(_MultiField):
+    """Similarity of a pair of records on a multi-valued field whose values
+    only match when equal, such as phone numbers or e-mail addresses.
+
+    Gives the same result as :class:`Average` (or :class:`Maximum`) with a
+    `compare` of 1.0 for equal values and 0.0 otherwise, but counts the
+    shared values with a set intersection in time linear in the number of
+    values, instead of comparing every pair of values.  Records without
+    values have a missing similarity.
+
+    :type field1: callable(`R`) [`T1`, ...]
+    :param field1: Returns a list of values for the field on first record.
+    :type encode1: function(`T1`) `V`
+    :param encode1: Encodes each field1 value for comparison.
+    :type field2: callable(`R`) [`T2`, ...]
+    :param field2: Returns a list of values for the field on second record\
+    (default: `field1`).
+    :type encode2: function(`T2`) `V`
+    :param encode2: Encodes each field2 value for comparison (`encode1`).
+    :type maximum: :class:`bool`
+    :param maximum: Return 1.0 if any value is shared, as for\
+    :class:`Maximum`, instead of the fraction of the shorter set of values\
+    that is shared.
+    :type cache: :class:`int`
+    :param cache: Most records to cache encoded values for (default 0).
+
+    >>> from dedupe import sim
+    >>> phones = lambda r: filter(None, r[1].split(';'))
+    >>> overlap = sim.Overlap(phones, lambda v: v.replace(' ', ''))
+    >>> overlap(('A', '555 1234;555 9876'), ('B', '5551234;5550000;5551111'))
+    0.5
+    >>> exact = lambda x, y: float(x == y)
+    >>> sim.Average(exact, phones, lambda v: v.replace(' ', ''))(
+    ...     ('A', '555 1234;555 9876'), ('B', '5551234;5550000;5551111'))
+    0.5
+    >>> sim.Overlap(phones, maximum=True)(('A', '1;2'), ('B', '2;3'))
+    1.0
+    >>> print overlap(('A', ''), ('B', '5551234'))
+    None
+    """
+
+    def __init__(self, field1, encode1=None, field2=None, encode2=None,
+                 maximum=False, cache=0):
+        _MultiField.__init__(self, None, field1, encode1, field2, encode2,
+                             1.0, cache)
+        self.maximum = maximum
+
+    def __call__(self, record1, record2):
+        """Return the overlap of `record1` and `record2` on this
+        multi-valued field."""
+        f1, f2 = self._sets(record1, record2)
+        if not f1 or not f2:
+            return None
+        if self.maximum:
+            return 0.0 if f1.isdisjoint(f2) else 1.0
+        return float(len(f1 & f2)) / min(len(f1), len(f2))
+
+
 class Record(_OrderedDict):
     """Returns a vector of field value similarities between two records.
 
@@ -271,6 +569,18 @@ class Record(_OrderedDict):
     :param \*simfuncs: Pairs of (field name, similarity function) used\
     to compute the tuple of similarities.
 
+    :type decide: function(`R`, `R`, :class:`Similarity`) `bool` | `None`
+    :param decide: Optional early-exit rule, such as a\
+    :class:`~classification.rulebased.Rule`.  It is called after each field\
+    with the similarities so far (`None` for fields not yet computed), and\
+    returning True or False stops the comparison.
+    :type costs: {:class:`str`: :class:`float`, ...}
+    :param costs: Relative cost of each field, so that cheap fields are\
+    computed first when there is a `decide` rule.  Fields without a cost\
+    follow in the order given.
+    :param skipped: Similarity for fields skipped once `decide` has\
+    made a decision (default `None`, like a missing value).
+
     :ivar Similarity: namedtuple class for the similarity of a pair of records\
     with field names corresponding to `simfuncs`.
 
@@ -285,16 +595,110 @@ class Record(_OrderedDict):
     >>> rcomp = sim.Record(("V1", vcomp1), ("V2", vcomp2))
     >>> rcomp(('A', 1, 1), ('B', 2, 4))
     Similarity(V1=0.5, V2=0.125)
+    >>> # V2 is cheap and decides that V1 is not worth computing
+    >>> decide = lambda a, b, s: False if s.V2 == 0.0 else None
+    >>> rcomp = sim.Record(("V1", vcomp1), ("V2", sim.Field(
+    ...     lambda x, y: float(x == y), 2)), decide=decide, costs={"V2": 1})
+    >>> rcomp(('A', 1, 1), ('B', 2, 4))
+    Similarity(V1=None, V2=0.0)
+    >>> rcomp(('A', 1, 4), ('B', 2, 4))
+    Similarity(V1=0.5, V2=1.0)
     """
 
-    def __init__(self, *simfuncs):
+    def __init__(self, *simfuncs, **kwargs):
+        decide = kwargs.pop('decide', None)
+        costs = kwargs.pop('costs', None) or {}
+        skipped = kwargs.pop('skipped', None)
+        if kwargs:
+            raise TypeError("{0!r}: unexpected keyword arguments.".format(
+                kwargs.keys()))
         super(Record, self).__init__(simfuncs)
         self.Similarity = collections.namedtuple("Similarity", self.keys())
+        for name in costs:
+            if name not in self:
+                raise ValueError("{0!r}: cost for unknown field.".format(name))
+        self.decide = decide
+        self.costs = costs
+        self.skipped = skipped
+        # Field positions and similarity functions in order of increasing cost
+        names, simfuncs = self.keys(), self.values()
+        order = range(len(self))
+        order.sort(key=lambda pos: (names[pos] not in costs,
+                                    costs.get(names[pos])))
+        self.order = [(pos, simfuncs[pos]) for pos in order]
 
     def __call__(self, A, B):
+        if self.decide is not None:
+            return self._decided(A, B)
         return self.Similarity._make(
             simfunc(A, B) for simfunc in self.itervalues())
 
+    def _decided(self, A, B):
+        """Compute fields in order of cost until `decide` returns True or
+        False, and fill the remaining fields with `skipped`."""
+        values = [None] * len(self.order)
+        for count, (pos, simfunc) in enumerate(self.order):
+            values[pos] = simfunc(A, B)
+            if count + 1 < len(self.order) and self.decide(
+                A, B, self.Similarity._make(values)) is not None:
+                for pos, _ in self.order[count + 1:]:
+                    values[pos] = self.skipped
+                break
+        return self.Similarity._make(values)
+
+    def log_stats(self):
+        """Log the counters of each :class:`Scale` and :class:`Memo` in the
+        similarity functions, which may wrap one another, under the name of
+        their field.
+
+        >>> from dedupe import sim
+        >>> scale = sim.Scale(sim.levenshtein, low=0.5)
+        >>> rcomp = sim.Record(("Name", sim.Field(sim.Memo(scale), 0)))
+        >>> for name in 'Smith', 'Jo', 'Smith':
+        ...     print rcomp(('Smith',), (name,))
+        Similarity(Name=1.0)
+        Similarity(Name=0.0)
+        Similarity(Name=1.0)
+        >>> def log(s, *a):
+        ...     print s % a
+        >>> LOG.info = log
+        >>> rcomp.log_stats()
+        name=MemoStats field=Name calls=3 hits=1 hitrate=0.333 codes=2
+        name=ScalePruned field=Name calls=2 pruned=1
+        >>> del LOG.info
+        """
+        for name, simfunc in self.iteritems():
+            seen = set()
+            while simfunc is not None and id(simfunc) not in seen:
+                seen.add(id(simfunc))
+                if isinstance(simfunc, Scale):
+                    simfunc.log_pruned(name)
+                    simfunc = simfunc.similarity
+                elif isinstance(simfunc, Memo):
+                    simfunc.log_stats(name)
+                    simfunc = simfunc.compare
+                else:
+                    simfunc = getattr(simfunc, 'compare', None)
+
+
+def getkeys(index, record):
+    """Keys of `record` in `index`, from its `getkeys` method (see
+    :class:`~block.Index`), or else from its `makekey` function for index
+    classes without one.
+
+    >>> from dedupe import block, sim
+    >>> class KeyOnly(dict):
+    ...     makekey = staticmethod(lambda r: [r[0]])
+    >>> sim.getkeys(KeyOnly(), ('A', 1))
+    ['A']
+    >>> sim.getkeys(block.Index(lambda r: [r[1]]), ('A', 1))
+    [1]
+    """
+    method = getattr(index, 'getkeys', None)
+    if method is not None:
+        return method(record)
+    return index.makekey(record)
+
 
 class Indices(_OrderedDict):
     """Dictionary containing indeces defined on a single set of records.
@@ -311,6 +715,11 @@ class Indices(_OrderedDict):
     :type records: [ `tuple`, ... ]
     :param records: List of records to insert into the indeces.
 
+    :type keepkeys: :class:`bool`
+    :param keepkeys: Have each index keep the keys of its records (see\
+    :class:`~block.Index`), for the index classes with a `keepkeys`\
+    parameter.
+
     >>> from dedupe import block, sim
     >>> makekey = lambda r: [int(r[1])]
     >>> makekey(('A', 3.5))
@@ -328,15 +737,32 @@ class Indices(_OrderedDict):
     Traceback (most recent call last):
         ...
     TypeError: []: not a strategy triple.
+    >>> class Plain(dict):
+    ...     def __init__(self, makekey, records):
+    ...         dict.__init__(self, ((makekey(r)[0], [r]) for r in records))
+    >>> sim.Indices([("Plain", Plain, makekey)], records1, keepkeys=True)
+    Indices([('Plain', {4: [('B', 4.5)], 5: [('C', 5.25)]})])
     """
 
-    def __init__(self, strategy, records=[]):
+    def __init__(self, strategy, records=[], keepkeys=False):
         for strat in strategy:
             self.check_strategy(strat)
         super(Indices, self).__init__(
-            (name, idxtype(keyfunc, records))
+            (name, idxtype(keyfunc, records, keepkeys=True)
+             if keepkeys and self.keeps_keys(idxtype)
+             else idxtype(keyfunc, records))
             for name, idxtype, keyfunc in strategy)
 
+    @staticmethod
+    def keeps_keys(idxtype):
+        """Whether the index class `idxtype` takes a `keepkeys` parameter."""
+        init = idxtype.__init__ if isinstance(idxtype, type) else idxtype
+        try:
+            spec = inspect.getargspec(init)
+        except TypeError:  # built-in or not a function
+            return False
+        return 'keepkeys' in spec.args or spec.keywords is not None
+
     @staticmethod
     def check_strategy(strategy):
         """Raise TypeError if strategy tuple is wrong in some way."""
@@ -373,7 +799,8 @@ class Indices(_OrderedDict):
                 index.compare(simfunc, None, comparisons)
         else:
             for index1, index2 in zip(self.itervalues(), other.itervalues()):
-                if type(index1) is not type(index2):
+                if not isinstance(index2, type(index1)) and \
+                   not isinstance(index1, type(index2)):
                     raise TypeError(
                         "Indeces of type {0} and type {1} are incompatible"\
                         .format(type(index1), type(index2)))
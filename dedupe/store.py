@@ -0,0 +1,716 @@
+"""Binary columnar snapshots of loaded records
+
+A snapshot saves the field names and the columns of string values of a list
+of records, so that later runs can skip parsing the CSV input.  Each column
+is stored as an array of byte offsets followed by the UTF-8 bytes of its
+values, and the file is memory-mapped on loading, so that opening a snapshot
+takes no time regardless of its size.  Use :func:`convert` to write a
+snapshot straight from a CSV file that is too large to load into memory.
+
+A :class:`MappedIndex` similarly maps a block index of saved records, as
+postings of record positions under sorted keys, so that new records can be
+linked against a large master without indexing the master again.
+
+The loaded :class:`Snapshot` is a sequence of :class:`RowView` objects, which
+look up their values in the mapped file on demand and support the attribute
+and item access used by :mod:`dedupe.get` field getters.
+
+File layout (integers are unsigned little-endian)::
+
+    magic "DDSTORE1"
+    rows (8 bytes), columns (4 bytes), length of names (4 bytes)
+    field names as UTF-8, separated by null bytes
+    per column: position of offsets, position of data (8 bytes each)
+    per column: rows+1 offsets (8 bytes each), then the data bytes
+"""
+
+from __future__ import with_statement
+
+import ast
+from collections import namedtuple
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+from dedupe import block, csv, fingerprint, sim
+from dedupe.compat import replace
+
+LOG = logging.getLogger('dedupe.store')
+
+_MAGIC = "DDSTORE1"
+_HEADER = struct.Struct("<8sQII")
+_COLUMN = struct.Struct("<QQ")
+_OFFSET = struct.Struct("<Q")
+_SPAN = struct.Struct("<QQ")
+_POSTING = struct.Struct("<q")
+
+# Index header: magic, fingerprints of the strategy and the records, counts
+# of records, keys and postings, and the size of the largest block
+_INDEX_MAGIC = "DDINDEX2"
+_INDEX_HEADER = struct.Struct("<8s40s40sQQQQ")
+
+
+def _encode(value):
+    """UTF-8 bytes of a value, converting non-strings to unicode."""
+    if not isinstance(value, unicode):
+        value = unicode(value)
+    return value.encode('utf-8')
+
+
+def save(path, records, fields=None):
+    """Save records to a snapshot file.
+
+    :type path: :class:`str`
+    :param path: Name of the snapshot file to write.
+    :type records: [`R`, ...]
+    :param records: List of records with string values.
+    :type fields: [:class:`str`, ...]
+    :param fields: Field names, by default the `_fields` of the first record.
+
+    >>> import os, tempfile
+    >>> from collections import namedtuple
+    >>> from dedupe import store
+    >>> Row = namedtuple('Row', 'Name City')
+    >>> path = os.path.join(tempfile.mkdtemp(), 'records.snapshot')
+    >>> store.save(path, [Row(u'Joe', u'Paris'), Row(u'Ren\\xe9', u'')])
+    >>> records = store.Snapshot(path)
+    >>> len(records), records.fields
+    (2, ('Name', 'City'))
+    >>> records[1]
+    Row(Name=u'Ren\\xe9', City=u'')
+    >>> records[0].City, records[0][0]
+    (u'Paris', u'Joe')
+    >>> from dedupe import get
+    >>> get.getter('Name')(records[1]) == u'Ren\\xe9'
+    True
+    >>> records.close()
+    >>> os.remove(path)
+    """
+    if fields is None:
+        fields = records[0]._fields if records else ()
+    with open(path, 'wb') as stream:
+        _write(stream, fields, len(records),
+               [[_encode(record[col]) for record in records]
+                for col in xrange(len(fields))])
+
+
+def _writeheader(stream, fields, nrows):
+    """Write the header and field names, returning the encoded names."""
+    names = "\0".join(_encode(field) for field in fields)
+    stream.write(_HEADER.pack(_MAGIC, nrows, len(fields), len(names)))
+    stream.write(names)
+    return names
+
+
+def _write(stream, fields, nrows, columns):
+    """Write a snapshot of `nrows` rows to `stream`, taking the encoded
+    values of each column from the iterables in `columns`.  Each column is
+    iterated twice, once for the offsets and once for the data."""
+    names = _writeheader(stream, fields, nrows)
+    position = _HEADER.size + len(names) + _COLUMN.size * len(fields)
+    directory = []
+    for column in columns:
+        # iterate once to compute the total data length
+        length = sum(len(value) for value in column)
+        directory.append((position, position + _OFFSET.size * (nrows + 1)))
+        position += _OFFSET.size * (nrows + 1) + length
+    for entry in directory:
+        stream.write(_COLUMN.pack(*entry))
+    for column in columns:
+        offset = 0
+        stream.write(_OFFSET.pack(offset))
+        for value in column:
+            offset += len(value)
+            stream.write(_OFFSET.pack(offset))
+        for value in column:
+            stream.write(value)
+
+
+def convert(csvpath, path, **kwargs):
+    """Convert a CSV file to a snapshot file, without holding the records
+    in memory: the offsets and data of each column are streamed to
+    temporary files and then copied into place.
+
+    :type csvpath: :class:`str`
+    :param csvpath: Name of the CSV file to read, which may be compressed\
+    (see :func:`~dedupe.csv.openfile`).
+    :type path: :class:`str`
+    :param path: Name of the snapshot file to write.
+    :param kwargs: Passed to :class:`~dedupe.csv.Reader`, such as the\
+    encoding and dialect.
+    :rtype: :class:`int`
+    :return: Number of records converted.
+
+    >>> import os, tempfile
+    >>> from dedupe import store
+    >>> tmpdir = tempfile.mkdtemp()
+    >>> csvpath = os.path.join(tmpdir, 'records.csv')
+    >>> with open(csvpath, 'wb') as out:
+    ...     out.write('Name,City\\r\\nJoe,Paris\\r\\nRen\\xe9,\\r\\n')
+    >>> store.convert(csvpath, os.path.join(tmpdir, 'records.snapshot'))
+    2
+    >>> records = store.Snapshot(os.path.join(tmpdir, 'records.snapshot'))
+    >>> list(records)
+    [Row(Name=u'Joe', City=u'Paris'), Row(Name=u'Ren\\xe9', City=u'')]
+    >>> records.close()
+    """
+    with csv.openfile(csvpath) as istream:
+        reader = csv.Reader(istream, **kwargs)
+        fields = reader.fields
+        offsetfiles = [tempfile.TemporaryFile() for _ in fields]
+        datafiles = [tempfile.TemporaryFile() for _ in fields]
+        try:
+            lengths = [0] * len(fields)
+            for stream in offsetfiles:
+                stream.write(_OFFSET.pack(0))
+            nrows = 0
+            for batch in reader.batches():
+                nrows += len(batch)
+                for col in xrange(len(fields)):
+                    values = [_encode(record[col]) for record in batch]
+                    offsets = []
+                    for value in values:
+                        lengths[col] += len(value)
+                        offsets.append(_OFFSET.pack(lengths[col]))
+                    offsetfiles[col].write("".join(offsets))
+                    datafiles[col].write("".join(values))
+            with open(path, 'wb') as stream:
+                names = _writeheader(stream, fields, nrows)
+                position = _HEADER.size + len(names) \
+                    + _COLUMN.size * len(fields)
+                for length in lengths:
+                    stream.write(_COLUMN.pack(
+                        position, position + _OFFSET.size * (nrows + 1)))
+                    position += _OFFSET.size * (nrows + 1) + length
+                for offsetfile, datafile in zip(offsetfiles, datafiles):
+                    for tmp in offsetfile, datafile:
+                        tmp.seek(0)
+                        shutil.copyfileobj(tmp, stream)
+        finally:
+            for tmp in offsetfiles + datafiles:
+                tmp.close()
+    LOG.info("name=ConvertSnapshot csv=%s path=%s records=%s",
+             csvpath, path, nrows)
+    return nrows
+
+
+class Snapshot(object):
+    """Sequence of records in a memory-mapped snapshot file.
+
+    :type path: :class:`str`
+    :param path: Name of the snapshot file written by :func:`save`.
+    :type typename: :class:`str`
+    :param typename: Name for the namedtuple class of :meth:`row`.
+
+    :ivar fields: Field names of the records.
+    :ivar positions: Mapping from field name to column number.
+    :ivar Row: namedtuple class for materialised records.
+    """
+
+    def __init__(self, path, typename='Row'):
+        self.path = path
+        self.stream = open(path, 'rb')
+        self.map = mmap.mmap(self.stream.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.nrows, ncols, namelen = _HEADER.unpack_from(self.map, 0)
+        if magic != _MAGIC:
+            raise IOError("{0}: not a record snapshot.".format(path))
+        start = _HEADER.size
+        names = self.map[start:start + namelen]
+        self.fields = tuple(str(name) for name in names.split("\0")) \
+            if ncols else ()
+        start += namelen
+        self.columns = [_COLUMN.unpack_from(self.map, start + _COLUMN.size * i)
+                        for i in xrange(ncols)]
+        self.positions = dict((name, i) for i, name in enumerate(self.fields))
+        self.Row = namedtuple(typename, self.fields)
+        LOG.info("name=LoadSnapshot path=%s records=%s fields=%s",
+                 path, self.nrows, len(self.fields))
+
+    def __len__(self):
+        return self.nrows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [RowView(self, i)
+                    for i in xrange(*index.indices(self.nrows))]
+        if index < 0:
+            index += self.nrows
+        if not 0 <= index < self.nrows:
+            raise IndexError("snapshot index out of range")
+        return RowView(self, index)
+
+    def __iter__(self):
+        for index in xrange(self.nrows):
+            yield RowView(self, index)
+
+    def value(self, index, column):
+        """Value in `column` of the record at `index`."""
+        offsets, data = self.columns[column]
+        start, end = _SPAN.unpack_from(
+            self.map, offsets + _OFFSET.size * index)
+        return self.map[data + start:data + end].decode('utf-8')
+
+    def row(self, index):
+        """The record at `index` as a :attr:`Row` namedtuple."""
+        return self.Row._make(self.value(index, column)
+                              for column in xrange(len(self.fields)))
+
+    def close(self):
+        """Unmap and close the snapshot file."""
+        self.map.close()
+        self.stream.close()
+
+
+class RowView(object):
+    """Record in a :class:`Snapshot`, identified by its position, that looks
+    up field values when they are accessed.  It behaves like the namedtuple
+    :attr:`Snapshot.Row`: fields are attributes, items and iteration give
+    the values, and views are equal and hash by position in the snapshot.
+    Views sort by their values, so that they can be sorted together with
+    namedtuple records.
+
+    >>> import os, tempfile
+    >>> from dedupe import store
+    >>> path = os.path.join(tempfile.mkdtemp(), 'master.snap')
+    >>> store.save(path, [('B', '2'), ('A', '1'), ('A', '1')], ('N', 'V'))
+    >>> snapshot = store.Snapshot(path)
+    >>> b, a1, a2 = snapshot
+    >>> a1 == a2, a1 < a2, a1 < b
+    (False, True, True)
+    >>> row = ('A', '2')
+    >>> sorted([b, row, a2, a1]) == [a1, a2, row, b]
+    True
+    >>> snapshot.close()
+    """
+
+    __slots__ = ('snapshot', 'index')
+
+    def __init__(self, snapshot, index):
+        self.snapshot = snapshot
+        self.index = index
+
+    @property
+    def _fields(self):
+        """Field names of the record."""
+        return self.snapshot.fields
+
+    def __getattr__(self, name):
+        if name in RowView.__slots__:
+            raise AttributeError(name)  # not yet initialised
+        try:
+            column = self.snapshot.positions[name]
+        except KeyError:
+            raise AttributeError(name)
+        return self.snapshot.value(self.index, column)
+
+    def __getitem__(self, column):
+        if isinstance(column, slice):
+            return tuple(self)[column]
+        if column < 0:
+            column += len(self.snapshot.fields)
+        if not 0 <= column < len(self.snapshot.fields):
+            raise IndexError("row index out of range")
+        return self.snapshot.value(self.index, column)
+
+    def __len__(self):
+        return len(self.snapshot.fields)
+
+    def __iter__(self):
+        for column in xrange(len(self.snapshot.fields)):
+            yield self.snapshot.value(self.index, column)
+
+    def materialize(self):
+        """Return the record as a :attr:`Snapshot.Row` namedtuple."""
+        return self.snapshot.row(self.index)
+
+    def __repr__(self):
+        return repr(self.materialize())
+
+    def _key(self):
+        """Identity of the view for equality and hashing."""
+        return (id(self.snapshot), self.index)
+
+    def _order(self, other):
+        """Pair of values to compare for ordering against `other`, which are
+        the field values as for the namedtuple of :meth:`materialize`, and
+        then the positions of two views with the same values, or
+        :keyword:`None` if `other` is not a record."""
+        if isinstance(other, RowView):
+            return (tuple(self), self._key()), (tuple(other), other._key())
+        if isinstance(other, tuple):
+            return tuple(self), other
+        return None
+
+    def __hash__(self):
+        return hash(self.index)
+
+    def __eq__(self, other):
+        return isinstance(other, RowView) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        order = self._order(other)
+        return NotImplemented if order is None else order[0] < order[1]
+
+    def __le__(self, other):
+        order = self._order(other)
+        return NotImplemented if order is None else order[0] <= order[1]
+
+    def __gt__(self, other):
+        order = self._order(other)
+        return NotImplemented if order is None else order[0] > order[1]
+
+    def __ge__(self, other):
+        order = self._order(other)
+        return NotImplemented if order is None else order[0] >= order[1]
+
+
+def _canonical(key):
+    """Key equal to `key` with one representation for keys that are equal
+    in a dict: ASCII strings as unicode, and whole numbers as integers."""
+    if isinstance(key, str):
+        try:
+            return key.decode('ascii')
+        except UnicodeDecodeError:
+            return key
+    if isinstance(key, float):
+        return int(key) if key.is_integer() else key
+    if isinstance(key, (bool, long)):
+        return int(key)
+    if isinstance(key, tuple):
+        return tuple(_canonical(item) for item in key)
+    return key
+
+
+def _keybytes(key):
+    """Sortable encoding of an index key, which must be a string, number or
+    tuple of these so that :func:`ast.literal_eval` can decode it.  Keys
+    that are equal in a dict have the same encoding.
+
+    >>> from dedupe.store import _keybytes
+    >>> _keybytes('x') == _keybytes(u'x'), _keybytes(5) == _keybytes(5.0)
+    (True, True)
+    >>> _keybytes((True, 2L)) == _keybytes((1.0, 2)), _keybytes(0.5)
+    (True, '0.5')
+    """
+    return repr(_canonical(key))
+
+
+def records_key(records):
+    """Fingerprint of indexed records, from the size and modification time
+    of the file of a :class:`Snapshot` (which is rewritten when its source
+    changes), and otherwise from the values of the records, which means
+    reading all of them.
+
+    >>> import os, tempfile
+    >>> from dedupe import fingerprint, store
+    >>> master = [('A', '5.5'), ('B', '4.5')]
+    >>> store.records_key(master) == fingerprint.records(master)
+    True
+    >>> path = os.path.join(tempfile.mkdtemp(), 'master.snap')
+    >>> store.save(path, master, ('Name', 'Value'))
+    >>> snapshot = store.Snapshot(path)
+    >>> store.records_key(snapshot) == fingerprint.records(snapshot)
+    False
+    >>> snapshot.close()
+    """
+    if isinstance(records, Snapshot):
+        info = os.stat(records.path)
+        return hashlib.sha1("{0}\0{1}\0{2!r}".format(
+            os.path.abspath(records.path), info.st_size,
+            info.st_mtime)).hexdigest()
+    return fingerprint.records(records)
+
+
+def save_index(path, index, records, strategykey='', recordskey=None):
+    """Save a block index as postings of record positions, sorted by key, for
+    loading with :class:`MappedIndex`.
+
+    :type path: :class:`str`
+    :param path: Name of the index file to write.
+    :type index: :class:`~block.Index`
+    :param index: Index of the `records`.
+    :type records: [`R`, ...]
+    :param records: Indexed records, whose positions identify them.
+    :type strategykey: :class:`str`
+    :param strategykey: Fingerprint of the index strategy (40 characters or\
+    empty), which :class:`MappedIndex` checks on loading.
+    :type recordskey: :class:`str` or :keyword:`None`
+    :param recordskey: Fingerprint of the `records`, also checked on\
+    loading (by default from the records themselves, or the file of a\
+    :class:`Snapshot`).
+    """
+    if recordskey is None:
+        recordskey = records_key(records)
+    positions = dict((record, i) for i, record in enumerate(records))
+    entries = sorted((_keybytes(key), [positions[record] for record in recs])
+                     for key, recs in index.iteritems())
+    npostings = sum(len(ids) for _, ids in entries)
+    largest = max(len(ids) for _, ids in entries) if entries else 0
+    tmppath = path + ".tmp"
+    with open(tmppath, 'wb') as stream:
+        stream.write(_INDEX_HEADER.pack(
+            _INDEX_MAGIC, strategykey, recordskey, len(records),
+            len(entries), npostings, largest))
+        for column in ([key for key, _ in entries],
+                       [struct.pack("<%dq" % len(ids), *ids)
+                        for _, ids in entries]):
+            offset = 0
+            stream.write(_OFFSET.pack(offset))
+            for value in column:
+                offset += len(value)
+                stream.write(_OFFSET.pack(offset))
+            for value in column:
+                stream.write(value)
+    replace(tmppath, path)
+    LOG.info("name=SaveIndex path=%s keys=%s postings=%s",
+             path, len(entries), npostings)
+
+
+def save_indices(prefix, indices, records, strategykeys=None,
+                 recordskey=None):
+    """Save each index in `indices` to :file:`{prefix}-{name}.idx` with
+    :func:`save_index`, using the matching fingerprint of `strategykeys`."""
+    strategykeys = strategykeys or [''] * len(indices)
+    if recordskey is None:
+        recordskey = records_key(records)
+    for (name, index), strategykey in zip(indices.iteritems(), strategykeys):
+        save_index("{0}-{1}.idx".format(prefix, name), index, records,
+                   strategykey, recordskey)
+
+
+def load_indices(prefix, strategy, records, strategykeys=None,
+                 recordskey=None):
+    """Load the indices saved by :func:`save_indices` as :class:`MappedIndex`
+    objects, raising :exc:`IOError` if any is missing or damaged, or was
+    saved for a different strategy or different records.
+
+    :type strategy: [ (`str`, `type`, `function`), ... ]
+    :param strategy: Index strategy of the saved indices.
+    :type recordskey: :class:`str` or :keyword:`None`
+    :param recordskey: Fingerprint of the `records` if already known (see\
+    :func:`records_key`).
+    :rtype: :class:`~sim.Indices`
+
+    >>> import os, tempfile
+    >>> from dedupe import block, sim, store
+    >>> makekey = lambda r: [int(r[1])]
+    >>> strategy = [("Idx", block.Index, makekey)]
+    >>> master = [('A', 5.5), ('B', 4.5), ('C', 5.25), ('D', 7.0)]
+    >>> prefix = os.path.join(tempfile.mkdtemp(), 'master')
+    >>> store.save_indices(prefix, sim.Indices(strategy, master), master)
+    >>> indices = store.load_indices(prefix, strategy, master)
+    >>> index = indices['Idx']
+    >>> len(index), 5 in index, 6 in index, index[5]
+    (3, True, False, [('A', 5.5), ('C', 5.25)])
+    >>> index[5.0] == index[5L] == index[5]
+    True
+    >>> sorted(index.iteritems())
+    [(4, [('B', 4.5)]), (5, [('A', 5.5), ('C', 5.25)]), (7, [('D', 7.0)])]
+    >>> new = sim.Indices(strategy, [('E', 5.0), ('F', 6.0)])
+    >>> compare = lambda a, b: a[0] + b[0]
+    >>> sorted(new.compare(compare, indices).values())
+    ['EA', 'EC']
+    >>> try:
+    ...     store.load_indices(prefix, strategy, master[:2])
+    ... except IOError, err:
+    ...     print str(err).split(': ')[-1]
+    index of 4 records, not 2.
+    >>> try:
+    ...     store.load_indices(prefix, strategy, master[:3] + [('D', 4.0)])
+    ... except IOError, err:
+    ...     print str(err).split(': ')[-1]
+    index of other records.
+    >>> index.close()
+    >>> path = prefix + '-Idx.idx'
+    >>> data = open(path, 'rb').read()
+    >>> for damaged in '', data[:100], data[:-1]:
+    ...     with open(path, 'wb') as out:
+    ...         out.write(damaged)
+    ...     try:
+    ...         store.load_indices(prefix, strategy, master)
+    ...     except IOError, err:
+    ...         print str(err).split(': ', 1)[-1].split(' (')[0]
+    not a record index
+    not a record index
+    truncated index.
+    """
+    strategykeys = strategykeys or [''] * len(strategy)
+    if recordskey is None:
+        recordskey = records_key(records)
+    indices = sim.Indices([])
+    try:
+        for (name, _, makekey), strategykey in zip(strategy, strategykeys):
+            indices[name] = MappedIndex("{0}-{1}.idx".format(prefix, name),
+                                        records, makekey, strategykey,
+                                        recordskey)
+    except IOError:
+        for index in indices.itervalues():
+            index.close()
+        raise
+    return indices
+
+
+class MappedIndex(block.Index):
+    """Read-only :class:`~block.Index` over postings saved by
+    :func:`save_index`, which are memory-mapped so that loading takes no
+    time.  Looking up a key is a binary search of the sorted keys, and the
+    records in a block are taken by position from `records`, so a
+    :class:`Snapshot` keeps the records on disk as well.
+
+    :type path: :class:`str`
+    :param path: Name of the index file.
+    :type records: [`R`, ...]
+    :param records: The records that were indexed, in the same order.
+    :type makekey: function(`R`) [`K`, ...]
+    :param makekey: Key function that the index was built with.
+    :type strategykey: :class:`str`
+    :param strategykey: Expected fingerprint of the index strategy.
+    :type recordskey: :class:`str` or :keyword:`None`
+    :param recordskey: Expected fingerprint of the `records` (see\
+    :func:`save_index`).
+    """
+
+    def __init__(self, path, records, makekey, strategykey='',
+                 recordskey=None):
+        super(MappedIndex, self).__init__(makekey)
+        self.path = path
+        self.records = records
+        self.stream = open(path, 'rb')
+        self.map = None
+        try:
+            self.map = mmap.mmap(self.stream.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+            (magic, filekey, filerecords, nrecords, self.nkeys,
+             self.npostings, self.largest) = _INDEX_HEADER.unpack_from(
+                 self.map, 0)
+            if magic != _INDEX_MAGIC:
+                raise IOError("{0}: not a record index.".format(path))
+            if filekey != strategykey.ljust(40, "\0"):
+                raise IOError("{0}: index of another strategy.".format(path))
+            if nrecords != len(records):
+                raise IOError("{0}: index of {1} records, not {2}.".format(
+                    path, nrecords, len(records)))
+            if recordskey is None:
+                recordskey = records_key(records)
+            if filerecords != recordskey.ljust(40, "\0"):
+                raise IOError("{0}: index of other records.".format(path))
+            self.keyoffsets = _INDEX_HEADER.size
+            self.keydata = self.keyoffsets + _OFFSET.size * (self.nkeys + 1)
+            self.postoffsets = self.keydata + _OFFSET.unpack_from(
+                self.map, self.keyoffsets + _OFFSET.size * self.nkeys)[0]
+            self.postdata = self.postoffsets + _OFFSET.size * (self.nkeys + 1)
+            end = self.postdata + _OFFSET.unpack_from(
+                self.map, self.postoffsets + _OFFSET.size * self.nkeys)[0]
+            if end != len(self.map):
+                raise IOError("{0}: truncated index.".format(path))
+        except (ValueError, struct.error), err:
+            # mmap rejects an empty file, and struct a truncated header
+            self.close()
+            raise IOError("{0}: not a record index ({1}).".format(path, err))
+        except IOError:
+            self.close()
+            raise
+        LOG.info("name=LoadIndex path=%s keys=%s postings=%s",
+                 path, self.nkeys, self.npostings)
+
+    def _keyat(self, i):
+        """Encoded key at position `i` in the sorted keys."""
+        start, end = _SPAN.unpack_from(
+            self.map, self.keyoffsets + _OFFSET.size * i)
+        return self.map[self.keydata + start:self.keydata + end]
+
+    def _recordsat(self, i):
+        """Records in the block at position `i` in the sorted keys."""
+        start, end = _SPAN.unpack_from(
+            self.map, self.postoffsets + _OFFSET.size * i)
+        ids = struct.unpack_from("<%dq" % ((end - start) // _POSTING.size),
+                                 self.map, self.postdata + start)
+        return [self.records[j] for j in ids]
+
+    def _find(self, key):
+        """Position of `key` in the sorted keys, or -1 if it is absent."""
+        try:
+            encoded = _keybytes(key)
+        except Exception:  # pylint: disable=W0703
+            return -1
+        low, high = 0, self.nkeys
+        while low < high:
+            middle = (low + high) // 2
+            if self._keyat(middle) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.nkeys and self._keyat(low) == encoded:
+            return low
+        return -1
+
+    def insert(self, record):
+        """Mapped indices are read-only."""
+        raise TypeError("{0}: cannot insert into a mapped index.".format(
+            self.path))
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    has_key = __contains__
+
+    def __getitem__(self, key):
+        position = self._find(key)
+        if position < 0:
+            raise KeyError(key)
+        return self._recordsat(position)
+
+    def get(self, key, default=None):
+        position = self._find(key)
+        return default if position < 0 else self._recordsat(position)
+
+    def __len__(self):
+        return self.nkeys
+
+    def __nonzero__(self):
+        return self.nkeys > 0
+
+    def iterkeys(self):
+        for i in xrange(self.nkeys):
+            yield ast.literal_eval(self._keyat(i))
+
+    __iter__ = iterkeys
+
+    def itervalues(self):
+        for i in xrange(self.nkeys):
+            yield self._recordsat(i)
+
+    def iteritems(self):
+        for i in xrange(self.nkeys):
+            yield ast.literal_eval(self._keyat(i)), self._recordsat(i)
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def log_size(self, name):
+        """Log block size statistics from the header of the index file."""
+        if self.nkeys:
+            LOG.info("name=IdxSize idx=%s recs=%s blocks=%s max=%s avg=%.2f",
+                     name, self.npostings, self.nkeys, self.largest,
+                     float(self.npostings) / self.nkeys)
+        else:
+            LOG.info("name=EmptyIndex idx=%s", name)
+
+    def close(self):
+        """Unmap and close the index file."""
+        if self.map is not None:
+            self.map.close()
+        self.stream.close()
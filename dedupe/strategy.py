@@ -0,0 +1,152 @@
+"""Evaluate index strategies against labelled matches
+
+Blocking trades recall for speed: an index strategy only compares records
+that share a key, so it misses any true match whose records have no key in
+common.  :func:`evaluate` reports for each index of a strategy, and each
+combination of them, the *pair completeness* (fraction of the labelled
+match pairs that share a key) and the *reduction ratio* (fraction of all
+pairs of records that are not compared), along with the largest block and
+the estimated cost of the comparisons.
+
+Everything is computed from the index keys: the distinct pairs are
+estimated by sampling as in :func:`~budget.sample_pairs`, and the comparator
+(if given) is only timed on the sampled pairs.
+"""
+
+from collections import namedtuple
+from itertools import combinations
+import logging
+import time
+
+import dedupe.budget as budget
+import dedupe.csv as csv
+import dedupe.sim as sim
+
+LOG = logging.getLogger('dedupe.strategy')
+
+
+class Report(namedtuple('Report',
+                        'names completeness reduction pairs largest seconds')):
+    """Evaluation of a combination of indices: the index names, pair
+    completeness, reduction ratio, estimated distinct pairs, size of the
+    largest block, and estimated seconds to compare the pairs
+    (:keyword:`None` without a comparator)."""
+    __slots__ = ()
+
+
+def _shares(index, rec1, rec2):
+    """Whether two records share a key in the index, which is always the
+    case for an index without keys."""
+    keys1, keys2 = sim.getkeys(index, rec1), sim.getkeys(index, rec2)
+    if keys1 is None or keys2 is None:
+        return True
+    return not set(keys1).isdisjoint(keys2)
+
+
+def _largest(index):
+    """Size of the largest block of an index, or of all its records for an
+    index without blocks."""
+    if isinstance(index, dict):
+        return max(len(recs) for recs in index.itervalues()) if index else 0
+    return len(getattr(index, 'records', ()))
+
+
+def evaluate(records, matches, strategy, comparator=None, combine=None,
+             sample=1000, seed=0):
+    """Evaluate each index in `strategy`, and combinations of them, for
+    linking `records` to themselves.
+
+    :type records: [`R`, ...]
+    :param records: Records to be linked.
+    :type matches: [(`R`, `R`), ...]
+    :param matches: Labelled match pairs, such as from\\
+    :func:`~classification.examples.matchpairs` (the key functions must\\
+    accept these records too).
+    :type strategy: [ (`str`, `type`, `function`), ... ]
+    :param strategy: Candidate indices, as for :class:`~sim.Indices`.
+    :type comparator: function(`R`, `R`) [:class:`float`, ...]
+    :param comparator: Optional comparator to time on sample pairs.
+    :type combine: :class:`int` or :keyword:`None`
+    :param combine: Most indices in a combination (default all).
+    :type sample: :class:`int`
+    :param sample: Number of records to sample for estimating pairs.
+    :type seed: :class:`int`
+    :param seed: Seed for choosing the sample.
+    :rtype: [:class:`Report`, ...]
+    :return: Reports on the combinations in order of size.
+
+    >>> from dedupe import block, strategy
+    >>> records = [('Joe', 'Smith'), ('Jo', 'Smith'), ('Joe', 'Smyth'),
+    ...            ('Ann', 'Lee'), ('Anne', 'Lee'), ('Bob', 'Stone')]
+    >>> matches = [(records[0], records[1]), (records[0], records[2]),
+    ...            (records[3], records[4])]
+    >>> candidates = [("First", block.Index, lambda r: [r[0]]),
+    ...               ("Last", block.Index, lambda r: [r[1]]),
+    ...               ("Initial", block.Index, lambda r: [r[0][0]])]
+    >>> for report in strategy.evaluate(records, matches, candidates,
+    ...                                 combine=2):
+    ...     print "{0} {1:.2f} {2:.2f} {3:.0f} {4}".format(*report)
+    ('First',) 0.33 0.93 1 2
+    ('Last',) 0.67 0.87 2 2
+    ('Initial',) 1.00 0.73 4 3
+    ('First', 'Last') 1.00 0.80 3 2
+    ('First', 'Initial') 1.00 0.73 4 3
+    ('Last', 'Initial') 1.00 0.73 4 3
+    """
+    indices = sim.Indices(strategy, records, keepkeys=True)
+    names = indices.keys()
+    found = dict((name, set(i for i, (rec1, rec2) in enumerate(matches)
+                            if _shares(index, rec1, rec2)))
+                 for name, index in indices.iteritems())
+    total = len(records) * (len(records) - 1) // 2
+    reports = []
+    for size in xrange(1, (combine or len(names)) + 1):
+        for combo in combinations(names, size):
+            subset = sim.Indices([])
+            for name in combo:
+                subset[name] = indices[name]
+            pairs, sampled, _ = budget.sample_pairs(
+                records, subset, sample=sample, seed=seed)
+            seconds = None
+            if comparator is not None and sampled:
+                start = time.time()
+                for rec1, rec2 in sampled:
+                    comparator(rec1, rec2)
+                seconds = pairs * (time.time() - start) / len(sampled)
+            report = Report(
+                combo,
+                float(len(set().union(*[found[name] for name in combo]))) /
+                len(matches) if matches else 1.0,
+                1.0 - pairs / total if total else 0.0,
+                pairs,
+                max(_largest(indices[name]) for name in combo),
+                seconds)
+            LOG.info("name=StrategyReport indices=%s completeness=%.3f "
+                     "reduction=%.4f pairs=%d largest=%d",
+                     "+".join(combo), *report[1:5])
+            reports.append(report)
+    return reports
+
+
+def write_csv(reports, ostream):
+    """Write the reports from :func:`evaluate` as CSV.
+
+    >>> from StringIO import StringIO
+    >>> from dedupe import strategy
+    >>> out = StringIO()
+    >>> strategy.write_csv([strategy.Report(('A', 'B'), 0.5, 0.9, 10.0, 3,
+    ...                     None)], out)
+    >>> for line in out.getvalue().splitlines():
+    ...     print line
+    Indices,Completeness,Reduction,Pairs,Largest,Seconds
+    A+B,0.5,0.9,10,3,
+    """
+    writer = csv.Writer(ostream)
+    writer.writerow(["Indices", "Completeness", "Reduction", "Pairs",
+                     "Largest", "Seconds"])
+    writer.writerows(
+        [u"+".join(report.names), unicode(report.completeness),
+         unicode(report.reduction), u"%.0f" % report.pairs,
+         unicode(report.largest),
+         u"" if report.seconds is None else unicode(report.seconds)]
+        for report in reports)
@@ -1,12 +1,17 @@
 #!/usr/bin/env python
 
+import __builtin__
+import gzip
 import logging
+import os
+import shutil
 import sys
+import tempfile
 import unittest
 from os.path import dirname, join
 sys.path.insert(0, dirname(dirname(dirname(__file__))))
 
-from dedupe import block, sim, linkcsv
+from dedupe import block, budget, csv, group, sim, linkcsv, store, strategy
 
 
 def classify(comparisons):
@@ -70,5 +75,379 @@ class TestLinkCSV(unittest.TestCase):
             "/master", indexing, comparator, classify, records, master=records)
         linker.write_all()
 
+
+class TestGroupStore(unittest.TestCase):
+
+    def setUp(self):
+        linkcsv.open = FakeOpen
+        logging.open = FakeOpen
+        self.tmpdir = tempfile.mkdtemp()
+        self.makekey = lambda r: [int(float(r[1]))]
+        self.comparator = sim.Record(("Compare", sim.Field(
+            lambda x, y: float(int(x) == int(y)), 1, float)))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def link(self, records):
+        return linkcsv.LinkCSV(
+            "/store", [("Idx", block.Index, self.makekey)], self.comparator,
+            classify, records, logname=None,
+            groupstore=join(self.tmpdir, "groups.pickle"))
+
+    def test(self):
+        linker = self.link([("A", "5.5"), ("B", "3.5"), ("C", "5.25")])
+        self.assertEqual(linker.groupstore.changed, set([0]))
+        # a new record joins the existing group, a new group is numbered 1
+        linker = self.link([("A", "5.5"), ("B", "3.5"), ("C", "5.25"),
+                            ("D", "5.0"), ("E", "1.0"), ("F", "1.5")])
+        self.assertEqual(linker.groupstore.changed, set([0, 1]))
+        self.assertEqual(linker.groupstore.groupid(("D", "5.0")), 0)
+        self.assertEqual(linker.groupstore.groupid(("F", "1.5")), 1)
+        self.assertEqual(linker.groupstore.groupid(("B", "3.5")), None)
+        linker.write_changed_groups()
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        linkcsv.open = FakeOpen
+        logging.open = FakeOpen
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test(self):
+        csvpath = join(self.tmpdir, "records.csv")
+        with open(csvpath, "wb") as stream:
+            stream.write("Name,Value\r\nA,5.5\r\nB,3.5\r\nC,5.25\r\n")
+        snappath = join(self.tmpdir, "records.snapshot")
+        records = linkcsv.loadcsv(csvpath, snapshot=snappath)
+        self.assertTrue(isinstance(records, store.Snapshot))
+        comparator = sim.Record(("Compare", sim.Field(
+            lambda x, y: float(int(x) == int(y)), 'Value', float)))
+        indexing = [("Idx", block.Index, lambda r: [int(float(r.Value))])]
+        # lazy records link the same as the loaded namedtuples
+        expected = linkcsv.LinkCSV(
+            "/snapshot", indexing, comparator, classify,
+            [record.materialize() for record in records], logname=None)
+        linker = linkcsv.LinkCSV(
+            "/snapshot", indexing, comparator, classify, records,
+            logname=None)
+        self.assertEqual(
+            sorted((a.materialize(), b.materialize())
+                   for a, b in linker.matches),
+            sorted(expected.matches))
+        linker.write_all()
+        records.close()
+        # an up to date snapshot is reused rather than converted again
+        mtime = os.path.getmtime(snappath)
+        linkcsv.loadcsv(csvpath, snapshot=snappath).close()
+        self.assertEqual(os.path.getmtime(snappath), mtime)
+
+
+class TestSnapshotMaster(unittest.TestCase):
+
+    def setUp(self):
+        linkcsv.open = __builtin__.open
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        linkcsv.open = FakeOpen
+        shutil.rmtree(self.tmpdir)
+
+    def test(self):
+        snappath = join(self.tmpdir, "master.snapshot")
+        store.save(snappath, [("C", "5.25"), ("A", "5.5"), ("B", "3.5")],
+                   ("Name", "Value"))
+        master = store.Snapshot(snappath)
+        comparator = sim.Record(("Compare", sim.Field(
+            lambda x, y: float(int(x) == int(y)), 1, float)))
+        indexing = [("Idx", block.Index, lambda r: [int(float(r[1]))])]
+        # groups mixing input tuples and master views sort by value
+        linker = linkcsv.LinkCSV(
+            self.tmpdir, indexing, comparator, classify, [("B", "5.0")],
+            master=master, logname=None,
+            groupstore=join(self.tmpdir, "store.csv"))
+        groups = group.UnionFind(linker.groupmatches).groups()
+        self.assertEqual([[tuple(r) for r in g] for g in groups],
+                         [[("A", "5.5"), ("B", "5.0"), ("C", "5.25")]])
+        linker.write_changed_groups()
+        with open(join(self.tmpdir, "changed-groups.csv")) as stream:
+            self.assertEqual(stream.read().splitlines(),
+                             ["0,A,5.5", "0,B,5.0", "0,C,5.25"])
+        master.close()
+
+
+class TestCompress(unittest.TestCase):
+
+    def setUp(self):
+        linkcsv.open = __builtin__.open
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        linkcsv.open = FakeOpen
+        shutil.rmtree(self.tmpdir)
+
+    def test(self):
+        csvpath = join(self.tmpdir, "records.csv.gz")
+        with gzip.open(csvpath, "wb") as stream:
+            stream.write("Name,Value\r\nA,5.5\r\nB,3.5\r\nC,5.25\r\n")
+        records = linkcsv.loadcsv(csvpath, processes=2)
+        self.assertEqual(records[2], ("C", "5.25"))
+        self.assertEqual(linkcsv.loadcsv(csvpath, bufsize=16), records)
+        self.assertEqual(list(csv.Reader(csvpath)), records)
+        comparator = sim.Record(("Compare", sim.Field(
+            lambda x, y: float(int(x) == int(y)), 'Value', float)))
+        indexing = [("Idx", block.Index, lambda r: [int(float(r.Value))])]
+        linker = linkcsv.LinkCSV(
+            self.tmpdir, indexing, comparator, classify, records,
+            logname=None, compress="gz", level=1, bufsize=1024)
+        linker.write_all(threads=3)
+        self.assertEqual(
+            linkcsv.loadcsv(join(self.tmpdir, "input-records.csv.gz")),
+            records)
+        with gzip.open(join(self.tmpdir, "groups.csv.gz")) as stream:
+            self.assertEqual(stream.read().splitlines(), [
+                "GroupID,Name,Value", "0,A,5.5", "0,C,5.25", ",B,3.5"])
+        self.assertTrue(os.path.exists(
+            join(self.tmpdir, "InputIdx-Idx.csv.gz")))
+
+
+CALLS = []  # calls of the key and comparison functions
+
+
+def counted_makekey(record):
+    CALLS.append(record)
+    return [int(float(record[1]))]
+
+
+def counted_compare(x, y):
+    CALLS.append((x, y))
+    return float(int(x) == int(y))
+
+
+class TestResume(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.records = [("A", "5.5"), ("B", "3.5"), ("C", "5.25")]
+        self.master = [("D", "5.0"), ("E", "3.0")]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def link(self, makekey, vcompare):
+        return linkcsv.LinkCSV(
+            self.tmpdir, [("Idx", block.Index, makekey)],
+            sim.Record(("Compare", sim.Field(vcompare, 1, float))),
+            classify, self.records, master=self.master, logname=None,
+            resume=True)
+
+    def test(self):
+        linker = self.link(counted_makekey, counted_compare)
+        self.assertTrue(CALLS)
+        # resuming loads the indices and comparisons without any calls
+        del CALLS[:]
+        resumed = self.link(counted_makekey, counted_compare)
+        self.assertEqual(CALLS, [])
+        self.assertEqual(resumed.indices1, linker.indices1)
+        self.assertEqual(resumed.indices2, linker.indices2)
+        self.assertEqual(resumed.comparisons, linker.comparisons)
+        self.assertEqual(resumed.matches, linker.matches)
+        # a changed comparator recomputes only the comparisons
+        changed = self.link(counted_makekey, lambda x, y: float(x == y))
+        self.assertEqual(CALLS, [])
+        self.assertEqual(changed.matches, {})
+        # a changed index strategy recomputes the indices
+        changed = self.link(lambda r: [r[0]], counted_compare)
+        self.assertEqual(changed.matches, {})
+
+
+class TestMasterIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.master = [("A", "5.5"), ("B", "3.5"), ("C", "5.25")]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def link(self, records):
+        return linkcsv.LinkCSV(
+            self.tmpdir, [("Idx", block.Index, counted_makekey)],
+            sim.Record(("Compare", sim.Field(counted_compare, 1, float))),
+            classify, records, master=self.master, logname=None,
+            masterindex=join(self.tmpdir, "master"))
+
+    def test(self):
+        linker = self.link([("D", "5.0")])
+        self.assertTrue(isinstance(linker.indices2["Idx"], block.Index))
+        # the saved master index is mapped, and only new records are keyed
+        del CALLS[:]
+        linker = self.link([("E", "3.0"), ("F", "9.0")])
+        self.assertTrue(
+            isinstance(linker.indices2["Idx"], store.MappedIndex))
+        self.assertEqual(CALLS, [("E", "3.0"), ("F", "9.0"), (3.0, 3.5)])
+        self.assertEqual(linker.matches, {(("E", "3.0"), ("B", "3.5")): 1.0})
+        # a changed master of the same size is indexed again
+        self.master = [("A", "5.5"), ("B", "9.5"), ("C", "5.25")]
+        linker = self.link([("F", "9.0")])
+        self.assertFalse(
+            isinstance(linker.indices2["Idx"], store.MappedIndex))
+        self.assertEqual(linker.matches, {(("F", "9.0"), ("B", "9.5")): 1.0})
+
+    def test_damaged(self):
+        self.link([("D", "5.0")])
+        path = join(self.tmpdir, "master-Idx.idx")
+        data = open(path, "rb").read()
+        # an empty or truncated index file is indexed again
+        for damaged in "", data[:50], data[:-1]:
+            with open(path, "wb") as out:
+                out.write(damaged)
+            linker = self.link([("F", "3.0")])
+            self.assertFalse(
+                isinstance(linker.indices2["Idx"], store.MappedIndex))
+            self.assertEqual(linker.matches,
+                             {(("F", "3.0"), ("B", "3.5")): 1.0})
+        linker = self.link([("F", "3.0")])
+        self.assertTrue(
+            isinstance(linker.indices2["Idx"], store.MappedIndex))
+
+
+class TestBudget(unittest.TestCase):
+
+    def test(self):
+        records = [(str(i), "5") for i in range(100)]
+        comparator = sim.Record(("Compare", sim.Field(counted_compare, 1)))
+        strategy = [("Idx", block.Index, lambda r: [int(float(r[1]))])]
+        del CALLS[:]
+        self.assertRaises(budget.BudgetExceeded, linkcsv.LinkCSV, None,
+                          strategy, comparator, classify, records,
+                          logname=None, budget=budget.Budget(pairs=1000))
+        # only the sample pairs were compared before giving up
+        self.assertTrue(len(CALLS) <= 100)
+        linker = linkcsv.LinkCSV(
+            None, strategy, comparator, classify, records, logname=None,
+            budget=budget.Budget(pairs=1000, warn=True))
+        self.assertEqual(len(linker.comparisons), 4950)
+
+
+class TestCollapse(unittest.TestCase):
+
+    def test(self):
+        records = [("A", "5"), ("a", "5"), ("B", "5"), ("A", "5"),
+                   ("C", "3"), ("c", "3")]
+        comparator = sim.Record(("Compare", sim.Field(counted_compare, 1)))
+        strategy = [("Idx", block.Index, lambda r: [r[1]])]
+        del CALLS[:]
+        linker = linkcsv.LinkCSV(
+            None, strategy, comparator, lambda c: ({}, c), records,
+            logname=None, collapse=lambda r: r[0].lower())
+        # only A-B is compared, and the duplicates form groups
+        self.assertEqual(len(CALLS), 1)
+        self.assertEqual(linker.linked1, [("A", "5"), ("B", "5"), ("C", "3")])
+        singles, groups = group.singles_and_groups(
+            linker.groupmatches, records)
+        self.assertEqual(singles, [("B", "5")])
+        self.assertEqual(groups, [[("A", "5"), ("a", "5")],
+                                  [("C", "3"), ("c", "3")]])
+
+    def test_master(self):
+        records = [("A", "1"), ("a", "1"), ("Z", "9")]
+        master = [("A", "1"), ("A ", "1")]
+        comparator = sim.Record(("Compare", sim.Field(counted_compare, 1)))
+        strategy = [("Idx", block.Index, lambda r: [r[1]])]
+        linker = linkcsv.LinkCSV(
+            None, strategy, comparator, classify, records, master=master,
+            logname=None,
+            collapse=lambda r: r[0].strip().lower())
+        # the duplicates of the input and the master are both kept
+        self.assertEqual(linker.copies1, {("A", "1"): [("a", "1")]})
+        self.assertEqual(linker.copies2, {("A", "1"): [("A ", "1")]})
+        singles, groups = group.singles_and_groups(
+            linker.groupmatches, records + master)
+        self.assertEqual(singles, [("Z", "9")])
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestLogStats(unittest.TestCase):
+
+    def test(self):
+        records = [("A", "Smith"), ("B", "Smyth"), ("C", "Jo")]
+        scale = sim.Scale(sim.levenshtein, low=0.5)
+        comparator = sim.Record(("Name", sim.Field(sim.Memo(scale), 1)))
+        strategy = [("Idx", block.Index, lambda r: ["all"])]
+        handler, logger = ListHandler(), logging.getLogger("dedupe.sim")
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        try:
+            linkcsv.LinkCSV(None, strategy, comparator, classify, records,
+                            logname=None)
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(logging.NOTSET)
+        # the counters of the comparator are logged after the comparisons
+        self.assertEqual(handler.messages[-2:], [
+            "name=MemoStats field=Name calls=3 hits=0 hitrate=0.000 codes=3",
+            "name=ScalePruned field=Name calls=3 pruned=2"])
+
+
+class KeyOnlyIndex(dict):
+    """Custom index with a `makekey` function but no `getkeys` method."""
+
+    def __init__(self, makekey, records=None):
+        dict.__init__(self)
+        self.makekey = makekey
+        self.index = block.Index(makekey, records)
+        self.update(self.index)
+
+    def compare(self, compare, other=None, comparisons=None):
+        return self.index.compare(compare, other, comparisons)
+
+    def count(self, other=None):
+        return self.index.count(other)
+
+    def log_size(self, name):
+        self.index.log_size(name)
+
+
+class TestKeyOnlyIndex(unittest.TestCase):
+
+    def setUp(self):
+        linkcsv.open = __builtin__.open
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        linkcsv.open = FakeOpen
+        shutil.rmtree(self.tmpdir)
+
+    def test(self):
+        records = [("A", "5.5"), ("B", "3.5"), ("C", "5.25")]
+        indexing = [("Idx", KeyOnlyIndex, lambda r: [int(float(r[1]))])]
+        comparator = sim.Record(("Compare", sim.Field(counted_compare, 1,
+                                                      float)))
+        linker = linkcsv.LinkCSV(
+            self.tmpdir, indexing, comparator, classify, records,
+            logname=None, keepkeys=True, resume=True,
+            budget=budget.Budget(pairs=10))
+        linker.write_all()
+        self.assertEqual(linker.matches,
+                         {(("A", "5.5"), ("C", "5.25")): 1.0})
+        reports = strategy.evaluate(
+            records, linker.matches.keys(), indexing)
+        self.assertEqual(reports[0].completeness, 1.0)
+
+
 if __name__ == "__main__":
     unittest.main()